@@ -0,0 +1,73 @@
+import math
+from collections import deque
+from typing import Deque, Iterable, Optional
+
+from ._metrics import WorkerMetrics, LOOP_LAG, CONNECTIONS
+
+AUTOSCALE_METRICS = {
+    'loop_lag': LOOP_LAG,
+    'connections': CONNECTIONS,
+}
+
+# number of observations the load is averaged over
+AUTOSCALE_WINDOW = 3
+
+
+class Autoscaler:
+    """
+    Picks the number of workers between min_workers and max_workers
+    from the load reported by workers: the mean event loop lag or number
+    of connections per worker. One worker is added when the load is above
+    up_threshold and one is removed when it is below down_threshold,
+    at most once per cooldown seconds
+    """
+
+    def __init__(
+        self,
+        min_workers: int,
+        max_workers: int,
+        metric: str = 'loop_lag',
+        up_threshold: float = 0.05,
+        down_threshold: float = 0.005,
+        cooldown: float = 30.0,
+    ):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.offset = AUTOSCALE_METRICS[metric]
+        self.up_threshold = up_threshold
+        self.down_threshold = down_threshold
+        self.cooldown = cooldown
+        self.samples: Deque[float] = deque(maxlen=AUTOSCALE_WINDOW)
+        self._scaled_at = -math.inf
+
+    def observe(self, workers: Iterable[WorkerMetrics]):
+        values = [w.values[self.offset] for w in workers]
+        if values:
+            self.samples.append(sum(values) / len(values))
+
+    @property
+    def load(self) -> Optional[float]:
+        if len(self.samples) < self.samples.maxlen:  # type: ignore[operator]
+            return None
+        return sum(self.samples) / len(self.samples)
+
+    def decide(self, workers: int, now: float) -> int:
+        """
+        Returns the number of workers the load calls for
+        """
+        load = self.load
+        if load is None or now - self._scaled_at < self.cooldown:
+            return workers
+
+        target = workers
+        if load > self.up_threshold:
+            target = workers + 1
+        elif load < self.down_threshold:
+            target = workers - 1
+        target = max(self.min_workers, min(self.max_workers, target))
+
+        if target != workers:
+            self._scaled_at = now
+            # the load is spread differently after scaling
+            self.samples.clear()
+        return target
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import struct
+import time
+from multiprocessing.context import BaseContext
+from multiprocessing.sharedctypes import RawArray
+from typing import Optional, Sequence, Tuple, List
+
+from aiohttp import web, hdrs
+
+# number of slots a key can be stored in, the least recently used one is replaced
+CACHE_WAYS = 8
+CACHE_LOCK_STRIPES = 64
+# a worker killed while holding a lock would block the others forever,
+# a busy stripe is a cache miss instead
+CACHE_LOCK_TIMEOUT = 0.01
+
+# key digest, expires, stored at, last used (wall clock, shared by processes), data length
+SLOT_HEADER = struct.Struct('<16sdddI')
+# status, length of JSON encoded headers
+ENTRY_HEADER = struct.Struct('<HI')
+
+CACHEABLE_STATUSES = frozenset((200, 203, 204, 300, 301, 308, 404, 410))
+# regenerated for every response
+SKIPPED_HEADERS = frozenset(
+    h.lower()
+    for h in (
+        hdrs.CONTENT_LENGTH,
+        hdrs.DATE,
+        hdrs.SERVER,
+        hdrs.CONNECTION,
+        hdrs.TRANSFER_ENCODING,
+        hdrs.KEEP_ALIVE,
+    )
+)
+
+
+class SharedCache:
+    """
+    Fixed size slots in shared memory created by the master process and
+    used by all workers. A key hashes to a set of CACHE_WAYS slots guarded
+    by one of CACHE_LOCK_STRIPES locks
+    """
+
+    def __init__(self, context: BaseContext, size: int, slot_size: int):
+        self.slot_size = slot_size
+        slots = max(CACHE_WAYS, size // slot_size)
+        self.sets = slots // CACHE_WAYS
+        self.data = RawArray('B', self.sets * CACHE_WAYS * slot_size)
+        self.locks = [context.Lock() for _ in range(min(self.sets, CACHE_LOCK_STRIPES))]
+        self._view: Optional[memoryview] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_view'] = None  # memoryview can't be pickled
+        return state
+
+    @property
+    def capacity(self) -> int:
+        return self.slot_size - SLOT_HEADER.size
+
+    @property
+    def view(self) -> memoryview:
+        if self._view is None:
+            self._view = memoryview(self.data).cast('B')
+        return self._view
+
+    def get(self, key: bytes) -> Optional[Tuple[bytes, float]]:
+        """
+        Returns data and the time it was stored
+        """
+        digest, index, lock = self._locate(key)
+        if not lock.acquire(timeout=CACHE_LOCK_TIMEOUT):
+            return None
+        try:
+            now = time.time()
+            view = self.view
+            for offset in self._slots(index):
+                slot_digest, expires, stored_at, _, length = SLOT_HEADER.unpack_from(view, offset)
+                if slot_digest != digest or not expires:
+                    continue
+                if expires <= now:
+                    SLOT_HEADER.pack_into(view, offset, b'', 0.0, 0.0, 0.0, 0)
+                    return None
+                SLOT_HEADER.pack_into(view, offset, digest, expires, stored_at, now, length)
+                start = offset + SLOT_HEADER.size
+                return bytes(view[start:start + length]), stored_at
+            return None
+        finally:
+            lock.release()
+
+    def put(self, key: bytes, data: bytes, ttl: float) -> bool:
+        if len(data) > self.capacity:
+            return False
+        digest, index, lock = self._locate(key)
+        if not lock.acquire(timeout=CACHE_LOCK_TIMEOUT):
+            return False
+        try:
+            now = time.time()
+            view = self.view
+            target = None
+            oldest = None
+            for offset in self._slots(index):
+                slot_digest, expires, _, last_used, _ = SLOT_HEADER.unpack_from(view, offset)
+                if slot_digest == digest or expires <= now:
+                    target = offset
+                    break
+                if oldest is None or last_used < oldest[0]:
+                    oldest = (last_used, offset)
+            if target is None:
+                target = oldest[1]  # type: ignore[index]
+            SLOT_HEADER.pack_into(view, target, digest, now + ttl, now, now, len(data))
+            start = target + SLOT_HEADER.size
+            view[start:start + len(data)] = data
+            return True
+        finally:
+            lock.release()
+
+    def _locate(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        index = int.from_bytes(digest[:8], 'little') % self.sets
+        return digest, index, self.locks[index % len(self.locks)]
+
+    def _slots(self, index: int):
+        first = index * CACHE_WAYS * self.slot_size
+        return range(first, first + CACHE_WAYS * self.slot_size, self.slot_size)
+
+
+def _parse_cache_control(value: str) -> dict:
+    result = {}
+    for item in value.split(','):
+        name, _, arg = item.strip().partition('=')
+        if name:
+            result[name.lower()] = arg.strip('"')
+    return result
+
+
+class ResponseCache:
+    """
+    Middleware answering GET requests from the SharedCache.
+    The key is method, host, path with query and the `vary` request headers.
+    Requests with Authorization, Cookie or `Cache-Control: no-cache/no-store` bypass the cache.
+    Only responses opting in with s-maxage, max-age or public are stored (up to `ttl`),
+    unless they are private, no-store, no-cache, set cookies or vary on other headers
+    """
+
+    def __init__(self, cache: SharedCache, ttl: float, vary: Sequence[str]):
+        self.cache = cache
+        self.ttl = ttl
+        self.vary = [h.lower() for h in vary]
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, request: web.Request) -> bytes:
+        parts = [request.method, request.host, request.path_qs]
+        parts.extend(request.headers.get(h, '') for h in self.vary)
+        return '\0'.join(parts).encode('utf-8', 'surrogateescape')
+
+    def is_cacheable_request(self, request: web.Request) -> bool:
+        if request.method != hdrs.METH_GET:
+            return False
+        # responses to them may depend on the user and app middlewares are skipped on hits
+        if hdrs.AUTHORIZATION in request.headers or hdrs.COOKIE in request.headers:
+            return False
+        cache_control = _parse_cache_control(request.headers.get(hdrs.CACHE_CONTROL, ''))
+        return 'no-cache' not in cache_control and 'no-store' not in cache_control
+
+    def get_ttl(self, response: web.StreamResponse) -> Optional[float]:
+        """
+        Time the response can be kept for or None if it is not cacheable
+        """
+        if not isinstance(response, web.Response) or response.status not in CACHEABLE_STATUSES:
+            return None
+        if not isinstance(response.body, (bytes, bytearray)):
+            return None  # streamed or a file payload
+        if getattr(response, '_compression', False) or hdrs.SET_COOKIE in response.headers:
+            return None
+        for header in response.headers.get(hdrs.VARY, '').split(','):
+            header = header.strip().lower()
+            if header and header not in self.vary:
+                return None  # including "*"
+
+        cache_control = _parse_cache_control(response.headers.get(hdrs.CACHE_CONTROL, ''))
+        if {'private', 'no-store', 'no-cache'} & set(cache_control):
+            return None
+        max_age = cache_control.get('s-maxage', cache_control.get('max-age'))
+        if max_age is None:
+            # without an explicit opt-in the response may be per user
+            return self.ttl if 'public' in cache_control else None
+        try:
+            return min(float(max_age), self.ttl) or None
+        except ValueError:
+            return None
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        if not self.is_cacheable_request(request):
+            return await handler(request)
+
+        key = self.get_key(request)
+        found = self.cache.get(key)
+        if found is not None:
+            self.hits += 1
+            data, stored_at = found
+            return _decode(data, stored_at)
+
+        self.misses += 1
+        response = await handler(request)
+        ttl = self.get_ttl(response)
+        if ttl is not None:
+            self.cache.put(key, _encode(response), ttl)
+        return response
+
+
+def _encode(response: web.Response) -> bytes:
+    headers: List[Tuple[str, str]] = [
+        (name, value)
+        for name, value in response.headers.items()
+        if name.lower() not in SKIPPED_HEADERS
+    ]
+    encoded = json.dumps(headers).encode()
+    return ENTRY_HEADER.pack(response.status, len(encoded)) + encoded + bytes(response.body)
+
+
+def _decode(data: bytes, stored_at: float) -> web.Response:
+    status, headers_length = ENTRY_HEADER.unpack_from(data)
+    start = ENTRY_HEADER.size
+    headers = json.loads(data[start:start + headers_length])
+    response = web.Response(status=status, body=data[start + headers_length:])
+    # Content-Type set by the body above is replaced
+    response.headers.popall(hdrs.CONTENT_TYPE, None)
+    for name, value in headers:
+        response.headers.add(name, value)
+    response.headers[hdrs.AGE] = str(max(0, int(time.time() - stored_at)))
+    return response
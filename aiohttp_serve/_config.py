@@ -5,12 +5,80 @@ import ssl
 
 from aiohttp import web
 from yarl import URL
-from typing import Optional, NamedTuple, Union, List, Type
+from typing import (
+    Optional,
+    NamedTuple,
+    Union,
+    List,
+    Type,
+    Sequence,
+    Iterable,
+    Dict,
+    Mapping,
+)
+
+
+# bind URL query options: name -> (type, applicable to unix sockets)
+BIND_OPTIONS = {
+    'backlog': (int, True),
+    'rcvbuf': (int, True),
+    'sndbuf': (int, True),
+    'nodelay': (bool, False),
+    'defer_accept': (int, False),
+    'fastopen': (int, False),
+    # inherited sockets only: serve https on the socket
+    'ssl': (bool, True),
+}
+
+# first file descriptor passed by systemd socket activation
+SD_LISTEN_FDS_START = 3
+
+
+def get_systemd_fds(name: Optional[str] = None) -> List[int]:
+    """
+    Returns listening sockets passed by systemd (LISTEN_FDS),
+    only those with FileDescriptorName=name if name is given
+    """
+    if os.environ.get('LISTEN_PID') != str(os.getpid()):
+        return []
+    count = int(os.environ.get('LISTEN_FDS', 0))
+    names = os.environ.get('LISTEN_FDNAMES', '').split(':')
+    return [
+        SD_LISTEN_FDS_START + i
+        for i in range(count)
+        if not name or (i < len(names) and names[i] == name)
+    ]
 
 
 class BindInfo:
-    def __init__(self, url: str):
+    def __init__(self, url: str, fd: Optional[int] = None, source: Optional[str] = None):
         self.url = URL(url)
+        self.options = self._parse_options()
+        # listening socket inherited from the previous master on binary upgrade
+        self._fd = fd
+        # bind url of the config this info comes from, differs for systemd: binds
+        self.source = source if source is not None else url
+
+    def _parse_options(self) -> Dict[str, Union[int, bool]]:
+        options: Dict[str, Union[int, bool]] = {}
+        for name, value in self.url.query.items():
+            if name not in BIND_OPTIONS:
+                raise ValueError(f'Unknown bind option {name!r} in {self.url}')
+            type_, unix = BIND_OPTIONS[name]
+            if self.is_unix_socket and not unix:
+                raise ValueError(f'Bind option {name!r} is not applicable to unix sockets')
+            if name == 'ssl' and not self.is_fd:
+                raise ValueError(f'Bind option {name!r} is only applicable to fd:// binds')
+            try:
+                number = int(value)
+            except ValueError:
+                raise ValueError(f'Bind option {name!r} should be an integer, got {value!r}')
+            options[name] = bool(number) if type_ is bool else number
+        return options
+
+    @property
+    def backlog(self) -> Optional[int]:
+        return self.options.get('backlog')  # type: ignore[return-value]
 
     @property
     def scheme(self) -> str:
@@ -30,12 +98,27 @@ class BindInfo:
 
     @property
     def is_ssl(self) -> bool:
+        if self.is_fd:
+            return bool(self.options.get('ssl'))
         return self.scheme.startswith('https')
 
     @property
     def is_unix_socket(self):
         return self.scheme == 'unix'
 
+    @property
+    def is_fd(self) -> bool:
+        # an already listening socket inherited from the parent process
+        return self.scheme in ('fd', 'systemd')
+
+    @property
+    def is_inherited(self) -> bool:
+        return self.is_fd or self._fd is not None
+
+    @property
+    def fd(self) -> int:
+        return self._fd if self._fd is not None else int(self.url.host)
+
     @property
     def is_ipv6(self):
         return self.host and ':' in self.host
@@ -49,15 +132,21 @@ class BoundSocket(NamedTuple):
     def url(self):
         return str(self.info.url)
 
-    def close(self):
+    def close(self, unlink: bool = True):
         self.socket.close()
-        if self.info.is_unix_socket:
+        # the socket file is kept when the socket is handed over to a new master
+        if self.info.is_unix_socket and unlink:
             try:
                 os.remove(self.info.path)
             except FileNotFoundError:  # pragma: no cover
                 pass
 
 
+# forward secret key exchange with AEAD ciphers only,
+# TLS 1.3 cipher suites are always enabled by OpenSSL
+MODERN_CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20:DHE+AESGCM:DHE+CHACHA20'
+
+
 class Config:
     def __init__(
         self,
@@ -65,6 +154,15 @@ class Config:
         port: Optional[int] = 8080,
         bind: Union[str, List[str]] = None,
         workers: int = 1,
+        min_workers: int = 1,
+        max_workers: Optional[int] = None,
+        autoscale_metric: str = 'loop_lag',
+        autoscale_up_threshold: float = 0.05,
+        autoscale_down_threshold: float = 0.005,
+        autoscale_interval: float = 5.0,
+        autoscale_cooldown: float = 30.0,
+        start_method: str = 'spawn',
+        preload_app: bool = False,
         use_uvloop: bool = True,
         ssl_certfile: Optional[str] = None,
         ssl_keyfile: Optional[str] = None,
@@ -72,14 +170,50 @@ class Config:
         ssl_version: int = ssl.PROTOCOL_TLS_SERVER,
         ssl_verify_mode: int = ssl.CERT_NONE,
         ssl_ca_certs: Optional[str] = None,
-        ssl_ciphers: str = 'TLSv1',
+        ssl_ciphers: str = MODERN_CIPHERS,
+        ssl_alpn_protocols: Optional[Sequence[str]] = ('http/1.1',),
+        ssl_session_tickets: bool = True,
+        ssl_ticket_key_rotation: Optional[float] = None,
+        ssl_watch_interval: Optional[float] = None,
         shutdown_timeout: float = 60.0,
         keepalive_timeout: float = 75.0,
+        adaptive_keepalive: bool = False,
+        keepalive_min_timeout: float = 5.0,
+        keepalive_pressure_threshold: float = 0.8,
         backlog: int = 128,
+        reuse_port: bool = False,
+        max_connections_per_worker: Optional[int] = None,
+        overload_policy: str = 'pause',
+        max_requests: Optional[int] = None,
+        max_requests_jitter: int = 0,
+        max_memory_rss: Optional[int] = None,
+        worker_timeout: Optional[float] = None,
+        executor_threads: Optional[int] = None,
+        executor_shutdown_timeout: float = 10.0,
+        memory_profiling: bool = False,
+        memory_profiling_interval: float = 60.0,
+        memory_profiling_frames: int = 1,
+        memory_profiling_dir: Optional[str] = None,
+        cpu_affinity: Union[None, str, Sequence[Union[int, Iterable[int]]]] = None,
+        static: Optional[Mapping[str, str]] = None,
+        static_cache_size: int = 1024,
+        static_cache_ttl: float = 1.0,
+        response_cache_size: Optional[int] = None,
+        response_cache_entry_size: int = 64 * 1024,
+        response_cache_ttl: float = 60.0,
+        response_cache_vary: Sequence[str] = ('Accept-Encoding',),
+        metrics_bind: Optional[str] = None,
+        control_socket: Optional[str] = None,
+        ready_fd: Optional[int] = None,
+        loop_monitor: bool = False,
+        slow_callback_threshold: float = 0.1,
         log_config: Optional[Union[dict, str]] = None,
         access_log_class: Type[web.AbstractAccessLogger] = web.AccessLogger,
         access_log_format: str = web.AccessLogger.LOG_FORMAT,
         access_log: Optional[logging.Logger] = web.access_logger,
+        async_access_log: bool = False,
+        access_log_queue_size: int = 10000,
+        access_log_queue_policy: str = 'drop',
         handle_signals: bool = True,
     ):
         self.host = host
@@ -87,6 +221,23 @@ class Config:
         self.bind = bind
 
         self.workers = workers
+        # autoscaling is enabled by max_workers
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        if max_workers is not None and not 1 <= min_workers <= workers <= max_workers:
+            raise ValueError('1 <= min_workers <= workers <= max_workers is required')
+        if autoscale_metric not in ('loop_lag', 'connections'):
+            raise ValueError('autoscale_metric should be "loop_lag" or "connections"')
+        self.autoscale_metric = autoscale_metric
+        self.autoscale_up_threshold = autoscale_up_threshold
+        self.autoscale_down_threshold = autoscale_down_threshold
+        self.autoscale_interval = autoscale_interval
+        self.autoscale_cooldown = autoscale_cooldown
+        self.start_method = start_method
+        self.preload_app = preload_app
+        if preload_app and start_method != 'fork':
+            raise ValueError('preload_app requires start_method="fork"')
+
         self.use_uvloop = use_uvloop
         self.ssl_certfile = ssl_certfile
         self.ssl_keyfile = ssl_keyfile
@@ -95,18 +246,114 @@ class Config:
         self.ssl_verify_mode = ssl_verify_mode
         self.ssl_ca_certs = ssl_ca_certs
         self.ssl_ciphers = ssl_ciphers
+        self.ssl_alpn_protocols = ssl_alpn_protocols
+        self.ssl_session_tickets = ssl_session_tickets
+        if ssl_ticket_key_rotation and start_method != 'fork':
+            raise ValueError('ssl_ticket_key_rotation requires start_method="fork"')
+        self.ssl_ticket_key_rotation = ssl_ticket_key_rotation
+        self.ssl_watch_interval = ssl_watch_interval
 
         self.shutdown_timeout = shutdown_timeout
         self.keepalive_timeout = keepalive_timeout
         self.backlog = backlog
+        self.reuse_port = reuse_port
+        self.max_connections_per_worker = max_connections_per_worker
+        if overload_policy not in ('pause', 'reject'):
+            raise ValueError('overload_policy should be "pause" or "reject"')
+        self.overload_policy = overload_policy
+
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_memory_rss = max_memory_rss
+
+        # idle connections are reaped by the pressure on these budgets
+        if adaptive_keepalive and not (max_connections_per_worker or max_memory_rss):
+            raise ValueError(
+                'adaptive_keepalive requires max_connections_per_worker or max_memory_rss'
+            )
+        if not 0 < keepalive_pressure_threshold < 1:
+            raise ValueError('keepalive_pressure_threshold should be between 0 and 1')
+        if keepalive_min_timeout > keepalive_timeout:
+            raise ValueError('keepalive_min_timeout should not exceed keepalive_timeout')
+        self.adaptive_keepalive = adaptive_keepalive
+        self.keepalive_min_timeout = keepalive_min_timeout
+        self.keepalive_pressure_threshold = keepalive_pressure_threshold
+        if worker_timeout is not None and worker_timeout <= 0:
+            raise ValueError('worker_timeout should be positive')
+        self.worker_timeout = worker_timeout
+        if executor_threads is not None and executor_threads < 1:
+            raise ValueError('executor_threads should be at least 1')
+        self.executor_threads = executor_threads
+        self.executor_shutdown_timeout = executor_shutdown_timeout
+        self.memory_profiling = memory_profiling
+        self.memory_profiling_interval = memory_profiling_interval
+        if memory_profiling_frames < 1:
+            raise ValueError('memory_profiling_frames should be at least 1')
+        self.memory_profiling_frames = memory_profiling_frames
+        self.memory_profiling_dir = memory_profiling_dir
+
+        if cpu_affinity is not None and cpu_affinity != 'auto':
+            if isinstance(cpu_affinity, str) or not cpu_affinity:
+                raise ValueError('cpu_affinity should be "auto" or a non-empty sequence of cpus')
+        self.cpu_affinity = cpu_affinity
+
+        for prefix, directory in (static or {}).items():
+            if not prefix.startswith('/'):
+                raise ValueError(f'static prefix should start with "/": {prefix}')
+            if not os.path.isdir(directory):
+                raise ValueError(f'static directory does not exist: {directory}')
+        self.static = static
+        self.static_cache_size = static_cache_size
+        self.static_cache_ttl = static_cache_ttl
+
+        if response_cache_size is not None and response_cache_size < response_cache_entry_size:
+            raise ValueError('response_cache_size should be at least response_cache_entry_size')
+        self.response_cache_size = response_cache_size
+        self.response_cache_entry_size = response_cache_entry_size
+        self.response_cache_ttl = response_cache_ttl
+        self.response_cache_vary = response_cache_vary
+
+        if metrics_bind is not None:
+            url = URL(metrics_bind)
+            # served by http.server of the master process
+            if url.scheme != 'http' or not url.host or url.path not in ('', '/') or url.query:
+                raise ValueError(f'metrics_bind should be http://host:port, got {metrics_bind}')
+        self.metrics_bind = metrics_bind
+        self.control_socket = control_socket
+        if ready_fd is not None and ready_fd < 0:
+            raise ValueError('ready_fd should be a file descriptor')
+        self.ready_fd = ready_fd
+        self.loop_monitor = loop_monitor
+        if slow_callback_threshold <= 0:
+            raise ValueError('slow_callback_threshold should be positive')
+        self.slow_callback_threshold = slow_callback_threshold
 
         self.log_config = log_config
         self.access_log_class = access_log_class
         self.access_log_format = access_log_format
         self.access_log = access_log
+        self.async_access_log = async_access_log
+        self.access_log_queue_size = access_log_queue_size
+        if access_log_queue_policy not in ('drop', 'block'):
+            raise ValueError('access_log_queue_policy should be "drop" or "block"')
+        self.access_log_queue_policy = access_log_queue_policy
 
         self.handle_signals = handle_signals
 
+    @property
+    def use_supervisor(self) -> bool:
+        # features served by the master process need it even for a single worker
+        return (
+            self.workers > 1
+            or self.max_workers is not None
+            or self.metrics_bind is not None
+            or self.control_socket is not None
+            or self.worker_timeout is not None
+            or self.max_requests is not None
+            or self.max_memory_rss is not None
+            or (self.is_ssl and self.ssl_watch_interval is not None)
+        )
+
     @property
     def is_ssl(self) -> bool:
         return bool(self.ssl_certfile)
@@ -114,25 +361,70 @@ class Config:
     def create_ssl_context(self) -> Optional[ssl.SSLContext]:
         if self.is_ssl:
             ctx = ssl.SSLContext(self.ssl_version)
-            get_password = (
-                (lambda: self.ssl_keyfile_password) if self.ssl_keyfile_password else None
-            )
-            ctx.load_cert_chain(self.ssl_certfile, self.ssl_keyfile, get_password)
+            self._load_ssl_files(ctx)
             ctx.verify_mode = self.ssl_verify_mode
-            if self.ssl_ca_certs:
-                ctx.load_verify_locations(self.ssl_ca_certs)
             if self.ssl_ciphers:
                 ctx.set_ciphers(self.ssl_ciphers)
+            if self.ssl_version == ssl.PROTOCOL_TLS_SERVER:
+                ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+            ctx.options |= ssl.OP_NO_COMPRESSION | ssl.OP_CIPHER_SERVER_PREFERENCE
+            if not self.ssl_session_tickets:
+                ctx.options |= ssl.OP_NO_TICKET
+            if self.ssl_alpn_protocols:
+                ctx.set_alpn_protocols(list(self.ssl_alpn_protocols))
             return ctx
         else:
             return None
 
-    def get_bind_info(self) -> List[BindInfo]:
+    def _get_systemd_bind_info(self, info: BindInfo) -> List[BindInfo]:
+        # systemd:[name][?options] stands for all sockets passed by systemd
+        # or those named by FileDescriptorName=
+        fds = get_systemd_fds(info.path)
+        if not fds:
+            raise ValueError(f'No sockets passed by systemd for {info.url}')
+        query = f'?{info.url.query_string}' if info.url.query_string else ''
+        return [BindInfo(f'fd://{fd}{query}', source=info.source) for fd in fds]
+
+    def reload_ssl_context(self, ctx: ssl.SSLContext):
+        """
+        Loads certificates into a live context, they are used for new handshakes only.
+        The files are validated with a throwaway context first,
+        so a broken certificate leaves ctx untouched
+        """
+        self._load_ssl_files(ssl.SSLContext(self.ssl_version))
+        self._load_ssl_files(ctx)
+
+    @property
+    def ssl_files(self) -> List[str]:
+        return [f for f in (self.ssl_certfile, self.ssl_keyfile, self.ssl_ca_certs) if f]
+
+    def _load_ssl_files(self, ctx: ssl.SSLContext):
+        get_password = (lambda: self.ssl_keyfile_password) if self.ssl_keyfile_password else None
+        ctx.load_cert_chain(self.ssl_certfile, self.ssl_keyfile, get_password)
+        if self.ssl_ca_certs:
+            ctx.load_verify_locations(self.ssl_ca_certs)
+
+    def get_bind_info(self, inherited: Optional[Dict[str, List[int]]] = None) -> List[BindInfo]:
+        """
+        `inherited` maps bind urls to sockets passed by the previous master
+        """
         if self.bind is not None:
-            if isinstance(self.bind, (str, bytes)):
-                return [BindInfo(self.bind)]
-            else:
-                return [BindInfo(url) for url in self.bind]
+            urls = [self.bind] if isinstance(self.bind, (str, bytes)) else self.bind
         else:
             scheme = 'https' if self.is_ssl else 'http'
-            return [BindInfo(f'{scheme}://{self.host}:{self.port}')]
+            urls = [f'{scheme}://{self.host}:{self.port}']
+
+        infos = []
+        for url in urls:
+            info = BindInfo(url)
+            fds = (inherited or {}).get(url)
+            if fds and info.is_fd:
+                query = f'?{info.url.query_string}' if info.url.query_string else ''
+                infos.extend(BindInfo(f'fd://{fd}{query}', source=url) for fd in fds)
+            elif fds:
+                infos.append(BindInfo(url, fd=fds[0]))
+            elif info.scheme == 'systemd':
+                infos.extend(self._get_systemd_bind_info(info))
+            else:
+                infos.append(info)
+        return infos
@@ -0,0 +1,121 @@
+import functools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional, Tuple
+
+from ._logging import logger
+
+# the master answers within this time unless it is stuck
+CONTROL_TIMEOUT = 10.0
+
+
+class ControlError(Exception):
+    pass
+
+
+class ControlServer:
+    """
+    Unix socket accepting one command per line and answering with one line of JSON.
+    Commands are executed by the supervise loop: they are queued here
+    and `wakeup` makes the loop call `process`
+    """
+
+    def __init__(self, path: str, wakeup: Callable[[], None]):
+        self.path = path
+        self.wakeup = wakeup
+        self.commands: 'queue.Queue[Tuple[str, Future]]' = queue.Queue()
+        self._server: Optional[socketserver.ThreadingUnixStreamServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        control = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    command = line.decode(errors='replace').strip()
+                    if not command:
+                        continue
+                    response = control.execute(command)
+                    self.wfile.write(json.dumps(response).encode() + b'\n')
+
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self._server = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self._server.daemon_threads = True
+        os.chmod(self.path, 0o600)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f'Control socket is listening on {self.path}')
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:  # pragma: no cover
+                pass
+
+    def execute(self, command: str) -> dict:
+        # runs in a handler thread
+        future: Future = Future()
+        self.commands.put((command, future))
+        self.wakeup()
+        try:
+            return dict(ok=True, result=future.result(CONTROL_TIMEOUT))
+        except ControlError as e:
+            return dict(ok=False, error=str(e))
+        except Exception as e:
+            return dict(ok=False, error=f'{type(e).__name__}: {e}')
+
+    def process(self, handle: Callable[[str, list], Any]):
+        """
+        Executes queued commands, called from the supervise loop.
+        A command answered by workers later returns a Future
+        """
+        while True:
+            try:
+                command, future = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            name, *args = command.split()
+            try:
+                result = handle(name, args)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            if isinstance(result, Future):
+                result.add_done_callback(functools.partial(_copy_result, future))
+            else:
+                future.set_result(result)
+
+
+def _copy_result(target: Future, source: Future):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def send_command(path: str, command: str, timeout: float = CONTROL_TIMEOUT) -> Any:
+    """
+    Sends a command to the control socket of a running master, returns the result
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(command.encode() + b'\n')
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline())
+    if not response['ok']:
+        raise ControlError(response['error'])
+    return response['result']
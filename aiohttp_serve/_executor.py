@@ -0,0 +1,80 @@
+import bisect
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from ._logging import logger
+
+EXECUTOR_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class WorkerExecutor(ThreadPoolExecutor):
+    """
+    Default executor of a worker: a thread pool that counts queued tasks
+    and measures how long they wait for a free thread
+    """
+
+    def __init__(self, max_workers: int):
+        super().__init__(max_workers, thread_name_prefix='aiohttp-serve-executor')
+        self.max_workers = max_workers
+        self.queued = 0
+        self.active = 0
+        self.tasks = 0
+        # a counter per bucket and the +Inf bucket
+        self.wait_counts: List[int] = [0] * (len(EXECUTOR_WAIT_BUCKETS) + 1)
+        self.wait_total = 0.0
+        self._stats_lock = threading.Lock()
+        self._backlogged = False
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        submitted = time.monotonic()
+
+        def run():
+            waited = time.monotonic() - submitted
+            with self._stats_lock:
+                self.queued -= 1
+                self.active += 1
+                self.tasks += 1
+                self.wait_counts[bisect.bisect_left(EXECUTOR_WAIT_BUCKETS, waited)] += 1
+                self.wait_total += waited
+                if self.queued == 0:
+                    self._backlogged = False
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._stats_lock:
+                    self.active -= 1
+
+        with self._stats_lock:
+            self.queued += 1
+            backlogged = self.queued > self.max_workers and not self._backlogged
+            if backlogged:
+                self._backlogged = True
+        if backlogged:
+            logger.warning(
+                f'Executor of worker process [{os.getpid()}] is backed up: '
+                f'{self.queued} tasks wait for {self.max_workers} threads'
+            )
+        try:
+            return super().submit(run)
+        except Exception:
+            with self._stats_lock:
+                self.queued -= 1
+            raise
+
+    def shutdown_with_timeout(self, timeout: float) -> bool:
+        """
+        Cancels queued tasks and waits for running ones up to timeout,
+        returns False if some threads are still busy
+        """
+        if sys.version_info >= (3, 9):
+            self.shutdown(wait=False, cancel_futures=True)
+        else:  # pragma: no cover
+            self.shutdown(wait=False)
+        deadline = time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(max(0.0, deadline - time.monotonic()))
+        return not any(thread.is_alive() for thread in self._threads)
@@ -0,0 +1,124 @@
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiohttp.web_protocol import RequestHandler
+
+from ._logging import logger
+from ._utils import get_rss
+
+# how often a worker checks its budgets and idle connections
+KEEPALIVE_CHECK_INTERVAL = 1.0
+
+
+def is_idle(handler: RequestHandler) -> bool:
+    """
+    Whether the connection waits for the next request
+    """
+    waiter = getattr(handler, '_waiter', None)
+    return (
+        waiter is not None
+        and not waiter.done()
+        and not getattr(handler, '_messages', None)
+        and not getattr(handler, '_request_in_progress', False)
+    )
+
+
+def count_idle(server: web.Server) -> int:
+    return sum(1 for handler in server.connections if is_idle(handler))
+
+
+class KeepaliveReaper:
+    """
+    Shortens the keep-alive timeout of idle connections when the worker nears
+    its connection or memory budget: from keepalive_timeout at pressure_threshold
+    down to min_timeout at the budget. Over the connection budget share
+    the oldest idle connections are closed first
+    """
+
+    def __init__(
+        self,
+        keepalive_timeout: float,
+        min_timeout: float,
+        pressure_threshold: float,
+        max_connections: Optional[int] = None,
+        max_memory_rss: Optional[int] = None,
+    ):
+        self.keepalive_timeout = keepalive_timeout
+        self.min_timeout = min_timeout
+        self.pressure_threshold = pressure_threshold
+        self.max_connections = max_connections
+        self.max_memory_rss = max_memory_rss
+        self.reaped = 0
+        # id of handler -> loop time it was first seen idle,
+        # for aiohttp versions that don't expose when the last request finished
+        self._seen_idle: Dict[int, float] = {}
+
+    def get_pressure(self, connections: int) -> float:
+        pressure = 0.0
+        if self.max_connections:
+            pressure = connections / self.max_connections
+        if self.max_memory_rss:
+            rss = get_rss(os.getpid())
+            if rss is not None:
+                pressure = max(pressure, rss / self.max_memory_rss)
+        return pressure
+
+    def get_timeout(self, pressure: float) -> float:
+        """
+        Idle timeout for the given pressure
+        """
+        if pressure < self.pressure_threshold:
+            return self.keepalive_timeout
+        share = min(1.0, (pressure - self.pressure_threshold) / (1.0 - self.pressure_threshold))
+        return self.keepalive_timeout - (self.keepalive_timeout - self.min_timeout) * share
+
+    def check(self, server: web.Server, now: float) -> int:
+        """
+        Closes idle connections over the shortened timeout and budget,
+        returns the number of closed ones
+        """
+        handlers = list(server.connections)
+        idle = self._get_idle(handlers, now)
+        pressure = self.get_pressure(len(handlers))
+        if pressure < self.pressure_threshold or not idle:
+            return 0
+
+        timeout = self.get_timeout(pressure)
+        # connections kept under the threshold share of the budget
+        excess = 0
+        if self.max_connections:
+            excess = len(handlers) - math.floor(self.max_connections * self.pressure_threshold)
+
+        idle.sort(key=lambda item: item[0])
+        closed = 0
+        for idle_since, handler in idle:
+            if closed >= excess and now - idle_since < timeout:
+                break
+            handler.force_close()
+            closed += 1
+
+        if closed:
+            self.reaped += closed
+            logger.debug(
+                f'Worker process [{os.getpid()}] closed {closed} idle connections '
+                f'(pressure {pressure:.2f}, keep-alive timeout {timeout:.1f}s)'
+            )
+        return closed
+
+    def _get_idle(
+        self, handlers: List[RequestHandler], now: float
+    ) -> List[Tuple[float, RequestHandler]]:
+        seen_idle, self._seen_idle = self._seen_idle, {}
+        result = []
+        for handler in handlers:
+            if not is_idle(handler):
+                continue
+            since = self._seen_idle[id(handler)] = seen_idle.get(id(handler), now)
+            # set when the connection was made and when the last request finished
+            close_time = getattr(handler, '_next_keepalive_close_time', 0.0)
+            if close_time:
+                since = close_time - handler.keepalive_timeout
+            result.append((since, handler))
+        return result
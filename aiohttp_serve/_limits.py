@@ -0,0 +1,168 @@
+import asyncio
+import os
+import socket
+import ssl
+from typing import List, Optional, Callable
+
+from aiohttp import web
+
+from ._logging import logger
+
+# how often a paused worker checks whether it can accept connections again
+RESUME_CHECK_INTERVAL = 0.05
+
+REJECT_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Type: text/plain\r\n'
+    b'Content-Length: 20\r\n'
+    b'Retry-After: 1\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+    b'Too many connections'
+)
+
+
+class RejectProtocol(asyncio.Protocol):
+    """
+    Answers a connection over the limit with 503 without reading the request
+    """
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        transport.write(REJECT_RESPONSE)  # type: ignore[attr-defined]
+        transport.close()
+
+
+class LimitedSockSite(web.SockSite):
+    """
+    SockSite that can stop and resume accepting connections.
+    The listening socket is never closed while paused, so connections
+    wait in its backlog or are taken by other workers sharing it.
+    It serves through its own asyncio server on a duplicate of the socket,
+    only the public parts of aiohttp sites and runners are used
+    """
+
+    def __init__(
+        self,
+        runner: web.BaseRunner,
+        sock: socket.socket,
+        *,
+        limiter: 'ConnectionLimiter',
+        shutdown_timeout: float = 60.0,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        backlog: int = 128,
+    ):
+        super().__init__(
+            runner,
+            sock,
+            shutdown_timeout=shutdown_timeout,
+            ssl_context=ssl_context,
+            backlog=backlog,
+        )
+        self._limiter = limiter
+        self._stopped = False
+        self._web_server = runner.server
+        self._listening_sock = sock
+        self._listening_ssl_context = ssl_context
+        self._listening_backlog = backlog
+        # None while paused, web.BaseSite never sees it
+        self._listener: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        # registers the site with the runner, SockSite.start would serve the socket itself
+        await web.BaseSite.start(self)
+        self._limiter.sites.append(self)
+        await self.resume()
+
+    async def stop(self):
+        self._stopped = True
+        if self in self._limiter.sites:
+            self._limiter.sites.remove(self)
+        self.pause()
+        await super().stop()
+
+    def pause(self):
+        if self._listener is not None:
+            # closes the duplicated socket only
+            self._listener.close()
+            self._listener = None
+
+    async def resume(self):
+        if self._listener is not None or self._stopped:
+            return
+        loop = asyncio.get_event_loop()
+        self._listener = await loop.create_server(
+            self._limiter.wrap(self._web_server),
+            sock=self._listening_sock.dup(),
+            ssl=self._listening_ssl_context,
+            backlog=self._listening_backlog,
+        )
+
+
+class ConnectionLimiter:
+    """
+    Keeps the number of connections of a worker under max_connections.
+    With the 'pause' policy the worker stops accepting at the limit,
+    with 'reject' connections over the limit are answered with 503
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        policy: str = 'pause',
+        on_reject: Optional[Callable[[], None]] = None,
+    ):
+        self.max_connections = max_connections
+        self.policy = policy
+        self.on_reject = on_reject
+        self.sites: List[LimitedSockSite] = []
+        self.rejected = 0
+        self._server: Optional[web.Server] = None
+        self._resume_task: Optional[asyncio.Future] = None
+
+    @property
+    def connections(self) -> int:
+        # connections still in the TLS handshake are not registered yet
+        return len(self._server.connections) if self._server is not None else 0
+
+    def wrap(self, server: web.Server) -> Callable[[], asyncio.BaseProtocol]:
+        self._server = server
+
+        def factory() -> asyncio.BaseProtocol:
+            connections = self.connections
+            if self.policy == 'reject' and connections >= self.max_connections:
+                self.rejected += 1
+                if self.on_reject is not None:
+                    self.on_reject()
+                return RejectProtocol()
+            if self.policy == 'pause' and connections + 1 >= self.max_connections:
+                # the transport of this connection is yet to be attached to the server
+                asyncio.get_event_loop().call_soon(self.pause)
+            return server()
+
+        return factory
+
+    def pause(self):
+        if self._resume_task is not None:
+            return
+        logger.debug(
+            f'Worker process [{os.getpid()}] reached max_connections '
+            f'({self.max_connections}), pausing accept'
+        )
+        for site in self.sites:
+            site.pause()
+        self._resume_task = asyncio.ensure_future(self._resume_when_ready())
+
+    async def _resume_when_ready(self):
+        try:
+            # the connection that reached the limit registers itself on the next iterations
+            await asyncio.sleep(RESUME_CHECK_INTERVAL)
+            while self.connections >= self.max_connections:
+                await asyncio.sleep(RESUME_CHECK_INTERVAL)
+            for site in list(self.sites):
+                await site.resume()
+        finally:
+            self._resume_task = None
+
+    def close(self):
+        if self._resume_task is not None:
+            self._resume_task.cancel()
@@ -1,9 +1,11 @@
 import json
 import logging
 import logging.config
+import logging.handlers
+import queue
 import sys
 import time
-from typing import Optional, Union
+from typing import Optional, Union, List
 
 logger = logging.getLogger('aiohttp.serve')
 
@@ -38,3 +40,76 @@ def configure_logging(log_config: Optional[Union[dict, str]] = None):
             # See the note about fileConfig() here:
             # https://docs.python.org/3/library/logging.config.html#configuration-file-format
             logging.config.fileConfig(log_config, disable_existing_loggers=False)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records into a bounded queue, a full queue either drops
+    the record or blocks the caller until there is room
+    """
+
+    def __init__(self, maxsize: int, block: bool = False):
+        super().__init__(queue.Queue(maxsize))
+        self.block = block
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting is left to the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.block:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if not self.dropped:
+                logger.warning(f'Log queue of {record.name!r} is full, dropping records')
+            self.dropped += 1
+
+
+def get_handlers(log: logging.Logger) -> List[logging.Handler]:
+    """
+    Returns handlers the logger actually emits records to, including its parents' ones
+    """
+    handlers: List[logging.Handler] = []
+    current: Optional[logging.Logger] = log
+    while current is not None:
+        handlers.extend(current.handlers)
+        if not current.propagate:
+            break
+        current = current.parent  # type: ignore[assignment]
+    return handlers
+
+
+class QueueLogging:
+    """
+    Moves writing of a logger's records to a background thread:
+    the logger gets a single queue handler, its former handlers are served by a listener
+    """
+
+    def __init__(self, log: logging.Logger, maxsize: int, block: bool = False):
+        self.log = log
+        self.handler = BoundedQueueHandler(maxsize, block=block)
+        self._own_handlers = list(log.handlers)
+        self._propagate = log.propagate
+        self._listener = logging.handlers.QueueListener(
+            self.handler.queue, *get_handlers(log), respect_handler_level=True
+        )
+
+    def start(self):
+        for handler in self._own_handlers:
+            self.log.removeHandler(handler)
+        self.log.addHandler(self.handler)
+        self.log.propagate = False
+        self._listener.start()
+
+    def stop(self):
+        self._listener.stop()  # writes out the records left in the queue
+        self.log.removeHandler(self.handler)
+        self.log.propagate = self._propagate
+        for handler in self._own_handlers:
+            self.log.addHandler(handler)
+        if self.handler.dropped:
+            logger.warning(f'{self.handler.dropped} records of {self.log.name!r} were dropped')
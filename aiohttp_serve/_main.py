@@ -1,11 +1,15 @@
-from typing import Optional, Union, List, Awaitable
+import logging
+import os
+from typing import Optional, Union, List, Awaitable, Callable, Any
 
 from aiohttp import web
 
 from ._config import Config
 from ._logging import configure_logging
 from ._socket import bind_sockets
+from ._startup import StartupTimeline
 from ._supervisor import Supervisor
+from ._utils import get_cpu_sets, set_cpu_affinity
 from ._worker import Worker
 
 
@@ -16,16 +20,41 @@ def serve(
     port: Optional[int] = 8080,
     bind: Union[str, List[str]] = None,
     workers: int = 1,
+    on_ready: Optional[Callable[[], Any]] = None,
     **kwargs,
 ):
+    startup = StartupTimeline()
     config = Config(host=host, port=port, bind=bind, workers=workers, **kwargs)
     configure_logging(config.log_config)
 
-    sockets = bind_sockets(config)
-    if config.workers > 1:
-        Supervisor(app, sockets=sockets, config=config).run()
+    with startup.phase('bind_sockets'):
+        sockets = bind_sockets(config)
+    handed_over = False
+    executor_abandoned = False
+    if config.use_supervisor:
+        supervisor = Supervisor(
+            app,
+            sockets=sockets,
+            config=config,
+            start_method=config.start_method,
+            startup=startup,
+            on_ready=on_ready,
+        )
+        supervisor.run()
+        handed_over = supervisor.handed_over
     else:
-        Worker(app, sockets=sockets, config=config).run()
+        cpu_sets = get_cpu_sets(config.cpu_affinity)
+        set_cpu_affinity(cpu_sets[0] if cpu_sets else None)
+        worker = Worker(
+            app, sockets=sockets, config=config, startup=startup, on_ready=on_ready
+        )
+        worker.run()
+        executor_abandoned = worker.executor_abandoned
 
     for s in sockets:
-        s.close()
+        s.close(unlink=not handed_over)
+
+    if executor_abandoned:
+        # the interpreter would wait for executor threads on exit
+        logging.shutdown()
+        os._exit(0)
@@ -0,0 +1,231 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.sharedctypes import RawArray
+from typing import Dict, List, Tuple, Iterable, Callable
+
+from ._config import BindInfo
+from ._executor import EXECUTOR_WAIT_BUCKETS
+from ._logging import logger
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# name, help
+COUNTERS = (
+    ('requests_total', 'Total number of handled requests'),
+    ('responses_1xx_total', 'Responses with 1xx status code'),
+    ('responses_2xx_total', 'Responses with 2xx status code'),
+    ('responses_3xx_total', 'Responses with 3xx status code'),
+    ('responses_4xx_total', 'Responses with 4xx status code'),
+    ('responses_5xx_total', 'Responses with 5xx status code'),
+    ('received_bytes_total', 'Request body bytes received'),
+    ('sent_bytes_total', 'Response body bytes sent'),
+    ('rejected_connections_total', 'Connections rejected over max_connections_per_worker'),
+    ('slow_callbacks_total', 'Callbacks blocking the event loop longer than the threshold'),
+    ('executor_tasks_total', 'Tasks started by the default executor (executor_threads only)'),
+    ('reaped_connections_total', 'Idle connections closed by adaptive keep-alive'),
+    ('response_cache_hits_total', 'Requests answered from the response cache'),
+    ('response_cache_misses_total', 'Cacheable requests not found in the response cache'),
+)
+GAUGES = (
+    ('active_requests', 'Requests being handled'),
+    ('connections', 'Open client connections'),
+    ('idle_connections', 'Open client connections waiting for the next request'),
+    ('loop_lag_seconds', 'Last measured event loop lag'),
+    ('loop_lag_p50_seconds', 'Median of recent event loop lag (loop_monitor only)'),
+    ('loop_lag_p99_seconds', '99th percentile of recent event loop lag (loop_monitor only)'),
+    ('executor_queue_depth', 'Tasks waiting for a thread of the default executor'),
+    ('executor_active_threads', 'Threads of the default executor running a task'),
+)
+HISTOGRAMS = (
+    ('request_duration_seconds', 'Request handling time', LATENCY_BUCKETS),
+    ('loop_lag_sample_seconds', 'Event loop lag samples', LOOP_LAG_BUCKETS),
+    ('executor_wait_seconds', 'Time tasks wait for an executor thread', EXECUTOR_WAIT_BUCKETS),
+)
+
+
+def _build_layout() -> Tuple[Dict[str, int], int]:
+    offsets = {}
+    size = 0
+    for name, _ in COUNTERS + GAUGES:
+        offsets[name] = size
+        size += 1
+    for name, _, buckets in HISTOGRAMS:
+        # a counter per bucket, the +Inf bucket and the sum of observed values
+        offsets[name] = size
+        size += len(buckets) + 2
+    return offsets, size
+
+
+OFFSETS, SIZE = _build_layout()
+
+REQUESTS = OFFSETS['requests_total']
+RESPONSES = OFFSETS['responses_1xx_total']
+RECEIVED_BYTES = OFFSETS['received_bytes_total']
+SENT_BYTES = OFFSETS['sent_bytes_total']
+ACTIVE_REQUESTS = OFFSETS['active_requests']
+CONNECTIONS = OFFSETS['connections']
+IDLE_CONNECTIONS = OFFSETS['idle_connections']
+REAPED_CONNECTIONS = OFFSETS['reaped_connections_total']
+RESPONSE_CACHE_HITS = OFFSETS['response_cache_hits_total']
+RESPONSE_CACHE_MISSES = OFFSETS['response_cache_misses_total']
+LOOP_LAG = OFFSETS['loop_lag_seconds']
+LOOP_LAG_P50 = OFFSETS['loop_lag_p50_seconds']
+LOOP_LAG_P99 = OFFSETS['loop_lag_p99_seconds']
+SLOW_CALLBACKS = OFFSETS['slow_callbacks_total']
+REJECTED_CONNECTIONS = OFFSETS['rejected_connections_total']
+EXECUTOR_TASKS = OFFSETS['executor_tasks_total']
+EXECUTOR_QUEUE_DEPTH = OFFSETS['executor_queue_depth']
+EXECUTOR_ACTIVE_THREADS = OFFSETS['executor_active_threads']
+
+
+class WorkerMetrics:
+    """
+    Metrics of a single worker process kept in shared memory.
+    The worker is the only writer, the master reads them without locking
+    """
+
+    def __init__(self):
+        self.values = RawArray('d', SIZE)
+
+    def add(self, offset: int, value: float = 1):
+        self.values[offset] += value
+
+    def set(self, offset: int, value: float):
+        self.values[offset] = value
+
+    def observe(self, name: str, buckets: Tuple[float, ...], value: float):
+        offset = OFFSETS[name]
+        self.values[offset + bisect.bisect_left(buckets, value)] += 1
+        self.values[offset + len(buckets) + 1] += value
+
+    def set_histogram(self, name: str, counts: List[int], total: float):
+        """
+        Copies a histogram kept elsewhere: a count per bucket, the +Inf bucket and the sum
+        """
+        offset = OFFSETS[name]
+        for i, count in enumerate(counts):
+            self.values[offset + i] = count
+        self.values[offset + len(counts)] = total
+
+    def observe_request(self, status: int, duration: float, received: int, sent: int):
+        values = self.values
+        values[REQUESTS] += 1
+        if 100 <= status < 600:
+            values[RESPONSES + status // 100 - 1] += 1
+        values[RECEIVED_BYTES] += received
+        values[SENT_BYTES] += sent
+        self.observe('request_duration_seconds', LATENCY_BUCKETS, duration)
+
+
+def _is_cumulative(offset: int) -> bool:
+    for name, _ in GAUGES:
+        if OFFSETS[name] == offset:
+            return False
+    return True
+
+
+CUMULATIVE = [_is_cumulative(i) for i in range(SIZE)]
+
+
+class MetricsCollector:
+    """
+    Aggregates metrics of worker processes by worker index.
+    Counters of exited workers are kept, so they never go down when a worker is restarted
+    """
+
+    def __init__(self, prefix: str = 'aiohttp_serve'):
+        self.prefix = prefix
+        self._retired: Dict[int, List[float]] = {}
+
+    def retire(self, index: int, metrics: WorkerMetrics):
+        retired = self._retired.setdefault(index, [0.0] * SIZE)
+        for i, value in enumerate(metrics.values):
+            if CUMULATIVE[i]:
+                retired[i] += value
+
+    def collect(self, workers: Iterable[Tuple[int, WorkerMetrics]]) -> Dict[int, List[float]]:
+        result = {index: list(values) for index, values in self._retired.items()}
+        for index, metrics in workers:
+            values = result.setdefault(index, [0.0] * SIZE)
+            for i, value in enumerate(metrics.values):
+                values[i] += value
+        return result
+
+    def render(self, workers: Iterable[Tuple[int, WorkerMetrics]]) -> str:
+        """
+        Renders metrics in Prometheus text exposition format
+        """
+        samples = sorted(self.collect(workers).items())
+        lines = []
+
+        for kind, metrics in (('counter', COUNTERS), ('gauge', GAUGES)):
+            for name, help_text in metrics:
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# HELP {full_name} {help_text}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                offset = OFFSETS[name]
+                for index, values in samples:
+                    lines.append(f'{full_name}{{worker="{index}"}} {values[offset]!r}')
+
+        for name, help_text, buckets in HISTOGRAMS:
+            full_name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} histogram')
+            offset = OFFSETS[name]
+            for index, values in samples:
+                count = 0.0
+                for i, le in enumerate(buckets + (float('+inf'),)):
+                    count += values[offset + i]
+                    le_text = '+Inf' if i == len(buckets) else repr(le)
+                    labels = f'worker="{index}",le="{le_text}"'
+                    lines.append(f'{full_name}_bucket{{{labels}}} {count!r}')
+                total = values[offset + len(buckets) + 1]
+                lines.append(f'{full_name}_sum{{worker="{index}"}} {total!r}')
+                lines.append(f'{full_name}_count{{worker="{index}"}} {count!r}')
+
+        lines.append('')
+        return '\n'.join(lines)
+
+
+class MetricsServer:
+    """
+    Serves metrics over HTTP from a background thread of the master process
+    """
+
+    def __init__(self, bind: str, render: Callable[[], str]):
+        self.info = BindInfo(bind)
+        self.render = render
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        render = self.render
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # noqa: N802
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # noqa
+                pass
+
+        self._server = ThreadingHTTPServer((self.info.host, self.info.port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f'Serving metrics on {self.info.url}/metrics')
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
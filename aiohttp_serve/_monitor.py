@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional, Deque, Tuple
+
+from ._logging import logger
+
+LOOP_MONITOR_INTERVAL = 0.1
+# number of lag samples percentiles are calculated from
+LOOP_MONITOR_WINDOW = 1000
+
+
+class SlowCallback:
+    def __init__(self, started: float, stack: str):
+        self.started = started
+        self.stack = stack
+        self.duration: Optional[float] = None
+
+
+class LoopMonitor:
+    """
+    Measures event loop lag and catches callbacks blocking the loop
+    longer than slow_callback_threshold: a watchdog thread takes the stack
+    of the loop thread while it is blocked, so the blocking code can be found
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        slow_callback_threshold: float,
+        interval: float = LOOP_MONITOR_INTERVAL,
+    ):
+        self.loop = loop
+        self.slow_callback_threshold = slow_callback_threshold
+        self.interval = interval
+
+        self.samples: Deque[float] = deque(maxlen=LOOP_MONITOR_WINDOW)
+        self.slow_callbacks: Deque[SlowCallback] = deque(maxlen=20)
+        self.slow_callbacks_count = 0
+        # time.monotonic() of the last tick of the loop
+        self.last_tick = time.monotonic()
+
+        self._blocked: Optional[SlowCallback] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Future] = None
+        self._stopped = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._task = asyncio.ensure_future(self._tick(), loop=self.loop)
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick(self):
+        interval = self.interval
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self.last_tick = now
+            self.samples.append(max(0.0, now - started - interval))
+
+            blocked, self._blocked = self._blocked, None
+            if blocked is not None:
+                blocked.duration = now - blocked.started
+                logger.warning(
+                    f'Event loop of worker process [{os.getpid()}] was blocked '
+                    f'for {blocked.duration:.3f}s in:\n{blocked.stack}'
+                )
+
+    def _watch(self):
+        threshold = self.slow_callback_threshold
+        while not self._stopped.wait(threshold / 2):
+            if self._blocked is not None:
+                continue
+            # the loop should tick every interval, anything beyond is blocking
+            last_tick = self.last_tick
+            blocked_since = last_tick + self.interval
+            if time.monotonic() - blocked_since < threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:  # pragma: no cover
+                continue
+            stack = ''.join(traceback.format_stack(frame))
+            if self.last_tick != last_tick:
+                continue  # the loop has just woken up
+            self._blocked = SlowCallback(blocked_since, stack)
+            self.slow_callbacks.append(self._blocked)
+            self.slow_callbacks_count += 1
+
+    def get_lag(self) -> Tuple[float, float]:
+        """
+        Returns p50 and p99 of event loop lag over the last LOOP_MONITOR_WINDOW samples
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0, 0.0
+        return samples[len(samples) // 2], samples[min(len(samples) - 1, len(samples) * 99 // 100)]
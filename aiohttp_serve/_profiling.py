@@ -0,0 +1,129 @@
+import os
+import time
+import tracemalloc
+from collections import deque
+from typing import Deque, Optional, Tuple, List, Dict, Any
+
+from ._logging import logger
+from ._utils import get_rss
+
+# number of periodic samples kept for the RSS and traced memory history
+MEMORY_HISTORY_SIZE = 60
+# number of allocation sites in a report
+MEMORY_REPORT_TOP = 20
+
+# allocations of the profiler itself are not interesting
+SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+class MemoryProfiler:
+    """
+    Traces memory allocations of a worker with tracemalloc and takes periodic
+    snapshots, so the allocation sites that keep growing can be found.
+    Only `frames` innermost frames of each allocation are kept to limit the overhead
+    """
+
+    def __init__(self, frames: int = 1, top: int = MEMORY_REPORT_TOP):
+        self.frames = frames
+        self.top = top
+        # monotonic time, RSS, traced memory
+        self.history: Deque[Tuple[float, Optional[int], int]] = deque(maxlen=MEMORY_HISTORY_SIZE)
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.last: Optional[tracemalloc.Snapshot] = None
+        self.started_at = time.monotonic()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.started_at = time.monotonic()
+        self.baseline = self.last = self._take_snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def sample(self):
+        """
+        Takes a periodic snapshot, a report compares the current one with it
+        """
+        self.last = self._take_snapshot()
+        traced, _ = tracemalloc.get_traced_memory()
+        self.history.append((time.monotonic(), get_rss(os.getpid()), traced))
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Allocation sites that grew the most since start and since the last periodic snapshot
+        """
+        snapshot = self._take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+        return dict(
+            pid=os.getpid(),
+            uptime=round(time.monotonic() - self.started_at, 3),
+            rss=get_rss(os.getpid()),
+            traced=traced,
+            traced_peak=peak,
+            history=[
+                dict(age=round(time.monotonic() - sampled_at, 3), rss=rss, traced=value)
+                for sampled_at, rss, value in self.history
+            ],
+            since_start=self._compare(snapshot, self.baseline),
+            since_last_sample=self._compare(snapshot, self.last),
+        )
+
+    def dump(self, directory: Optional[str] = None) -> str:
+        """
+        Writes a report to a text file, returns its path
+        """
+        report = self.report()
+        directory = directory or os.getcwd()
+        path = os.path.join(
+            directory, f'aiohttp-serve-memory-{report["pid"]}-{int(time.time())}.txt'
+        )
+        lines = [
+            f'pid: {report["pid"]}',
+            f'uptime: {report["uptime"]}s',
+            f'rss: {report["rss"]}',
+            f'traced: {report["traced"]} (peak {report["traced_peak"]})',
+            '',
+            'history (age, rss, traced):',
+        ]
+        for item in report['history']:
+            lines.append(f'  -{item["age"]}s {item["rss"]} {item["traced"]}')
+        for key in ('since_start', 'since_last_sample'):
+            lines.append('')
+            lines.append(f'top allocation sites {key.replace("_", " ")}:')
+            for stat in report[key]:
+                lines.append(
+                    f'  {stat["site"]}: {stat["size"]} bytes ({stat["size_diff"]:+}), '
+                    f'{stat["count"]} blocks ({stat["count_diff"]:+})'
+                )
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        logger.info(f'Worker process [{report["pid"]}] dumped memory report to {path}')
+        return path
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    def _compare(
+        self, snapshot: tracemalloc.Snapshot, old: Optional[tracemalloc.Snapshot]
+    ) -> List[Dict[str, Any]]:
+        if old is None:  # pragma: no cover
+            return []
+        result = []
+        for stat in snapshot.compare_to(old, 'lineno')[: self.top]:
+            frame = stat.traceback[0]
+            result.append(
+                dict(
+                    site=f'{frame.filename}:{frame.lineno}',
+                    size=stat.size,
+                    size_diff=stat.size_diff,
+                    count=stat.count,
+                    count_diff=stat.count_diff,
+                )
+            )
+        return result
@@ -5,18 +5,26 @@ from typing import List
 
 from ._config import Config, BindInfo, BoundSocket
 from ._logging import logger
+from ._upgrade import pop_inherited_fds
 
 
 def bind_sockets(config: Config) -> List[BoundSocket]:
-    infos = config.get_bind_info()
-    sockets = [BoundSocket(socket=bind_socket(i), info=i) for i in infos]
+    infos = config.get_bind_info(pop_inherited_fds())
+    sockets = [
+        BoundSocket(socket=bind_socket(i, reuse_port=config.reuse_port), info=i) for i in infos
+    ]
     names = [s.url for s in sockets]
     logger.info(f'Running on {", ".join(names)} (Press CTRL+C to quit)')
     return sockets
 
 
-def bind_socket(info: BindInfo):
-    if info.is_unix_socket:
+def bind_socket(info: BindInfo, reuse_port: bool = False):
+    if info.is_inherited:
+        sock = socket.socket(fileno=info.fd)
+        if not sock.getsockopt(socket.SOL_SOCKET, socket.SO_ACCEPTCONN):
+            sock.detach()
+            raise ValueError(f'File descriptor {info.fd} is not a listening socket')
+    elif info.is_unix_socket:
         path = os.fspath(info.path)
         sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         try:
@@ -49,10 +57,11 @@ def bind_socket(info: BindInfo):
             family = socket.AF_INET
 
         sock = socket.socket(family, socket.SOCK_STREAM)
-        # try:
-        #     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        # except AttributeError:
-        #     pass
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):  # pragma: no cover
+                sock.close()
+                raise ValueError('SO_REUSEPORT is not supported on this platform')
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
             sock.bind((host, port))
@@ -61,6 +70,8 @@ def bind_socket(info: BindInfo):
             logger.error(e)
             raise
 
+    set_socket_options(sock, info)
+
     sock.setblocking(False)
     try:
         sock.set_inheritable(True)
@@ -69,6 +80,40 @@ def bind_socket(info: BindInfo):
     return sock
 
 
+def set_socket_options(sock: socket.socket, info: BindInfo):
+    """
+    Applies options from the bind URL query to the listening socket,
+    accepted connections inherit buffer sizes and TCP_NODELAY from it
+    """
+    options = info.options
+    try:
+        if 'rcvbuf' in options:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, options['rcvbuf'])
+        if 'sndbuf' in options:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, options['sndbuf'])
+        if 'nodelay' in options:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(options['nodelay']))
+        if 'defer_accept' in options:
+            # the connection is accepted only when request data has arrived
+            sock.setsockopt(
+                socket.IPPROTO_TCP, _get_tcp_option('TCP_DEFER_ACCEPT'), options['defer_accept']
+            )
+        if 'fastopen' in options:
+            # request data in SYN from clients that visited before saves a round trip
+            sock.setsockopt(
+                socket.IPPROTO_TCP, _get_tcp_option('TCP_FASTOPEN'), options['fastopen']
+            )
+    except Exception:
+        sock.close()
+        raise
+
+
+def _get_tcp_option(name: str) -> int:
+    if not hasattr(socket, name):  # pragma: no cover
+        raise ValueError(f'{name} is not supported on this platform')
+    return getattr(socket, name)
+
+
 def share_socket(sock: socket.socket) -> socket.socket:  # pragma: no cover
     # Windows requires the socket be explicitly shared across
     # multiple workers (processes).
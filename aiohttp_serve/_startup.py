@@ -0,0 +1,79 @@
+import os
+import socket
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Iterator
+
+from ._config import Config
+from ._logging import logger
+from ._upgrade import notify_upgrade_ready
+
+
+class StartupTimeline:
+    """
+    Durations of startup phases in seconds, in the order they happened
+    """
+
+    def __init__(self, started_at: Optional[float] = None):
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - started
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def __str__(self):
+        return format_phases(self.phases)
+
+
+def format_phases(phases: Dict[str, float]) -> str:
+    return ', '.join(f'{name} {duration:.3f}s' for name, duration in phases.items())
+
+
+def sd_notify(state: str) -> bool:
+    """
+    Sends a state to the service manager (systemd Type=notify),
+    returns False if the process is not run by one
+    """
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):  # abstract namespace
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode())
+    except OSError as e:
+        logger.warning(f'Failed to notify service manager: {e}')
+        return False
+    return True
+
+
+def notify_ready(config: Config, on_ready: Optional[Callable[[], Any]] = None):
+    """
+    Tells whoever waits for the server that all workers are listening:
+    the previous master on binary upgrade, ready_fd, the service manager and on_ready
+    """
+    upgraded = notify_upgrade_ready()
+    # a new master started on upgrade doesn't inherit ready_fd
+    if config.ready_fd is not None and not upgraded:
+        try:
+            os.write(config.ready_fd, b'\n')
+            os.close(config.ready_fd)
+        except OSError as e:
+            logger.warning(f'Failed to write to ready_fd {config.ready_fd}: {e}')
+    sd_notify(f'READY=1\nMAINPID={os.getpid()}')
+    if on_ready is not None:
+        try:
+            on_ready()
+        except Exception:
+            logger.exception('Error in on_ready callback')
@@ -0,0 +1,274 @@
+import asyncio
+import mimetypes
+import os
+import stat
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, IO, Mapping, Optional, Tuple
+
+from aiohttp import web, hdrs
+
+# precompressed variants looked up next to a file, in the order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# chunk size of transports without sendfile support (TLS)
+STATIC_CHUNK_SIZE = 256 * 1024
+
+
+class CachedFile:
+    """
+    An open file shared by requests, it is closed once evicted and not in use
+    """
+
+    def __init__(self, path: str, file: IO[bytes], st: os.stat_result):
+        self.path = path
+        self.file = file
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.users = 0
+        self.evicted = False
+
+    def acquire(self):
+        self.users += 1
+
+    def release(self):
+        self.users -= 1
+        if self.evicted and self.users == 0:
+            self.file.close()
+
+    def evict(self):
+        self.evicted = True
+        if self.users == 0:
+            self.file.close()
+
+
+def _open(path: str, root: str) -> Tuple[Optional[IO[bytes]], Optional[os.stat_result]]:
+    # symlinks leading out of the served directory are not followed
+    if os.path.commonpath([os.path.realpath(path), root]) != root:
+        return None, None
+    try:
+        file = open(path, 'rb')
+    except OSError:
+        return None, None
+    try:
+        st = os.fstat(file.fileno())
+    except OSError:  # pragma: no cover
+        file.close()
+        return None, None
+    if not stat.S_ISREG(st.st_mode):
+        file.close()
+        return None, None
+    return file, st
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+class FileCache:
+    """
+    LRU cache of open files and their stat results. An entry is revalidated
+    by stat at most once per ttl seconds and reopened when the file changed,
+    missing files are cached as well
+    """
+
+    def __init__(self, size: int = 1024, ttl: float = 1.0):
+        self.size = size
+        self.ttl = ttl
+        # path -> open file or None if there is no such file
+        self._entries: 'OrderedDict[str, Optional[CachedFile]]' = OrderedDict()
+        self._checked_at: Dict[str, float] = {}
+
+    async def get(self, path: str, root: str) -> Optional[CachedFile]:
+        now = time.monotonic()
+        if path in self._entries and now - self._checked_at[path] < self.ttl:
+            self._entries.move_to_end(path)
+            return self._entries[path]
+
+        loop = asyncio.get_event_loop()
+        entry = self._entries.get(path)
+        if entry is not None:
+            st = await loop.run_in_executor(None, _stat, path)
+            if st is not None and (st.st_ino, st.st_size, st.st_mtime_ns) == entry.key:
+                self._store(path, entry, now)
+                return entry
+
+        file, st = await loop.run_in_executor(None, _open, path, root)
+        entry = CachedFile(path, file, st) if file is not None else None
+        self._store(path, entry, now)
+        return entry
+
+    def _store(self, path: str, entry: Optional[CachedFile], now: float):
+        old = self._entries.pop(path, None)
+        if old is not None and old is not entry:
+            old.evict()
+        self._entries[path] = entry
+        self._checked_at[path] = now
+        while len(self._entries) > self.size:
+            evicted_path, evicted = self._entries.popitem(last=False)
+            del self._checked_at[evicted_path]
+            if evicted is not None:
+                evicted.evict()
+
+    def close(self):
+        for entry in self._entries.values():
+            if entry is not None:
+                entry.evict()
+        self._entries.clear()
+        self._checked_at.clear()
+
+
+class StaticFiles:
+    """
+    Serves files of a directory under a URL prefix from the FileCache with sendfile,
+    picks a precompressed .br or .gz variant when the client accepts it
+    """
+
+    def __init__(self, prefix: str, directory: str, cache: FileCache):
+        self.prefix = '/' + prefix.strip('/')
+        self.directory = os.path.realpath(directory)
+        self.cache = cache
+
+    def add_route(self, app: web.Application):
+        app.router.add_route(hdrs.METH_GET, self.prefix + '/{path:.+}', self.handle)
+        app.router.add_route(hdrs.METH_HEAD, self.prefix + '/{path:.+}', self.handle)
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        path = self._resolve(request.match_info['path'])
+        if path is None:
+            raise web.HTTPNotFound()
+
+        accepted = _parse_accept_encoding(request.headers.get(hdrs.ACCEPT_ENCODING, ''))
+        encoding = None
+        entry = None
+        for name, suffix in ENCODINGS:
+            if accepted.get(name, accepted.get('*', 0.0)) > 0:
+                entry = await self.cache.get(path + suffix, self.directory)
+                if entry is not None:
+                    encoding = name
+                    break
+        if entry is None:
+            entry = await self.cache.get(path, self.directory)
+            if entry is None:
+                raise web.HTTPNotFound()
+
+        entry.acquire()
+        try:
+            return await self._send(request, path, entry, encoding)
+        finally:
+            entry.release()
+
+    def _resolve(self, relative: str) -> Optional[str]:
+        if '\0' in relative:
+            return None  # not a valid path, open() would raise ValueError
+        parts = relative.split('/')
+        if any(part in ('', '.', '..') or part.startswith('.') for part in parts):
+            # hidden files and traversal are not served
+            return None
+        return os.path.join(self.directory, *parts)
+
+    async def _send(
+        self,
+        request: web.Request,
+        path: str,
+        entry: CachedFile,
+        encoding: Optional[str],
+    ) -> web.StreamResponse:
+        headers = {
+            hdrs.ETAG: entry.etag,
+            hdrs.LAST_MODIFIED: entry.last_modified,
+            hdrs.VARY: hdrs.ACCEPT_ENCODING,
+        }
+        if _not_modified(request, entry):
+            return web.Response(status=304, headers=headers)
+
+        response = web.StreamResponse(headers=headers)
+        response.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        response.content_length = entry.size
+        if encoding is not None:
+            response.headers[hdrs.CONTENT_ENCODING] = encoding
+
+        writer = await response.prepare(request)
+        if request.method == hdrs.METH_HEAD or not entry.size:
+            await response.write_eof()
+            return response
+
+        transport = request.transport
+        if transport is None:
+            raise ConnectionResetError('Connection lost')
+        loop = asyncio.get_event_loop()
+        # TLS transports can't sendfile, the asyncio fallback would seek the shared file
+        if transport.get_extra_info('sslcontext') is None:
+            try:
+                await loop.sendfile(transport, entry.file, 0, entry.size, fallback=False)
+                await response.write_eof()
+                return response
+            except (NotImplementedError, asyncio.SendfileNotAvailableError):
+                pass  # nothing is sent yet
+
+        offset = 0
+        while offset < entry.size:
+            size = min(STATIC_CHUNK_SIZE, entry.size - offset)
+            chunk = await loop.run_in_executor(None, _read, entry.file, offset, size)
+            if not chunk:  # pragma: no cover
+                break  # truncated since stat
+            await writer.write(chunk)
+            offset += len(chunk)
+        await response.write_eof()
+        return response
+
+
+def _read(file: IO[bytes], offset: int, size: int) -> bytes:
+    return os.pread(file.fileno(), size, offset)
+
+
+def _parse_accept_encoding(value: str) -> Dict[str, float]:
+    """
+    Encoding -> q-value, q=0 means the encoding is refused
+    """
+    result = {}
+    for item in value.split(','):
+        name, *params = item.split(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, arg = param.strip().partition('=')
+            if key.lower() == 'q':
+                try:
+                    q = float(arg)
+                except ValueError:
+                    q = 0.0
+        result[name] = q
+    return result
+
+
+def _not_modified(request: web.Request, entry: CachedFile) -> bool:
+    if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+    if if_none_match is not None:
+        return entry.etag in [tag.strip() for tag in if_none_match.split(',')] or (
+            if_none_match.strip() == '*'
+        )
+    if_modified_since = request.headers.get(hdrs.IF_MODIFIED_SINCE)
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(entry.mtime) <= since
+    return False
+
+
+def mount_static(app: web.Application, static: Mapping[str, str], cache: FileCache):
+    """
+    Adds routes serving the directories by URL prefix
+    """
+    for prefix, directory in static.items():
+        StaticFiles(prefix, directory, cache).add_route(app)
@@ -1,75 +1,996 @@
+import asyncio
+import ctypes
+import faulthandler
+import logging
 import multiprocessing
+import multiprocessing.connection
 import os
 import platform
 import random
+import ssl
 import time
-from typing import List
+from multiprocessing.connection import Connection
+from multiprocessing.sharedctypes import RawValue
+from typing import List, Dict, Optional, Any, Union, Awaitable, Set, Tuple, Callable
 import signal
+import subprocess
+from concurrent.futures import Future
 
+from aiohttp import web
 from aiohttp.web_runner import GracefulExit
 
 from ._config import Config, BoundSocket
+from ._control import ControlServer, ControlError
 from ._logging import logger, configure_logging
-from ._worker import Worker
+from ._metrics import (
+    WorkerMetrics,
+    MetricsCollector,
+    MetricsServer,
+    REQUESTS,
+    ACTIVE_REQUESTS,
+    CONNECTIONS,
+    IDLE_CONNECTIONS,
+    LOOP_LAG,
+    LOOP_LAG_P50,
+    LOOP_LAG_P99,
+    EXECUTOR_QUEUE_DEPTH,
+    EXECUTOR_ACTIVE_THREADS,
+)
+from ._autoscale import Autoscaler
+from ._cache import SharedCache
+from ._startup import StartupTimeline, notify_ready, sd_notify, format_phases
+from ._upgrade import start_new_master
+from ._utils import get_rss, load_application, get_cpu_sets, set_cpu_affinity
+from ._worker import Worker, ACCEPT_GRACE_PERIOD, get_heartbeat_interval
 
 multiprocessing.allow_connection_pickling()
 
+# a worker that dies sooner than this after start is considered crashing,
+# its restarts are delayed exponentially up to RESPAWN_BACKOFF_MAX seconds
+WORKER_MIN_UPTIME = 5.0
+RESPAWN_BACKOFF_MIN = 0.1
+RESPAWN_BACKOFF_MAX = 30.0
+
+MEMORY_CHECK_INTERVAL = 5.0
+
+# extra time given to a stopping worker on top of shutdown_timeout
+# before it gets killed
+STOP_TIMEOUT_MARGIN = 5.0
+
+
+# signals handled by the supervise loop: SIGHUP reloads workers,
+# SIGUSR1 reloads certificates, SIGUSR2 starts a new master (binary upgrade),
+# SIGTTIN and SIGTTOU add and remove a worker
+MASTER_SIGNALS = [
+    getattr(signal, name)
+    for name in ('SIGHUP', 'SIGUSR1', 'SIGUSR2', 'SIGTTIN', 'SIGTTOU')
+    if hasattr(signal, name)
+]
+
+# how often the master checks if the new master started on upgrade is still alive
+UPGRADE_CHECK_INTERVAL = 1.0
+
+# time given to a hung worker to dump its stack before it gets killed
+STACK_DUMP_TIMEOUT = 1.0
+
 
 def shutdown(sig, frame):  # noqa
     raise GracefulExit()
 
 
 def run_worker(
-    app: str,
+    app: Union[str, web.Application, Awaitable[web.Application]],
     *,
     sockets: List[BoundSocket],
     config: Config,
+    conn: Connection,
+    metrics: Optional[WorkerMetrics],
+    cpus: Optional[Set[int]] = None,
+    ssl_context: Optional[ssl.SSLContext] = None,
+    heartbeat: Optional[ctypes.c_double] = None,
+    response_cache: Optional[SharedCache] = None,
 ):
+    startup = StartupTimeline()
+    # a forked worker inherits signal handlers of the master
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    for sig in MASTER_SIGNALS:
+        signal.signal(sig, signal.SIG_DFL)
+
+    if heartbeat is not None and hasattr(signal, 'SIGUSR1'):
+        # the master asks a hung worker for its stack before killing it,
+        # faulthandler writes it to stderr even if the interpreter is stuck
+        faulthandler.register(signal.SIGUSR1, all_threads=True)
+
     configure_logging(config.log_config)
-    Worker(app, sockets=sockets, config=config).run()
+    set_cpu_affinity(cpus)
+    worker = Worker(
+        app,
+        sockets=sockets,
+        config=config,
+        conn=conn,
+        metrics=metrics,
+        ssl_context=ssl_context,
+        heartbeat=heartbeat,
+        response_cache=response_cache,
+        startup=startup,
+    )
+    worker.run()
+    if worker.executor_abandoned:
+        # the interpreter would wait for executor threads on exit
+        logging.shutdown()
+        os._exit(0)
+
+
+class WorkerProcess:
+    def __init__(
+        self,
+        process: multiprocessing.Process,
+        conn: Connection,
+        index: int,
+        generation: int,
+        metrics: Optional[WorkerMetrics] = None,
+        heartbeat: Optional[ctypes.c_double] = None,
+    ):
+        self.process = process
+        self.conn: Optional[Connection] = conn
+        self.metrics = metrics
+        self.heartbeat = heartbeat
+        self.index = index
+        self.generation = generation
+        self.started_at = time.monotonic()
+        self.ready = False
+        # durations of startup phases reported by the worker once it is ready
+        self.startup_phases: Dict[str, float] = {}
+
+        self.stopping = False
+        self.stop_deadline: Optional[float] = None
+        # missed heartbeats, killed once its stack is dumped
+        self.hung = False
+        # whether a new worker should be started when this one exits
+        self.respawn = True
+        # the old worker this one is going to replace once it is ready
+        self.replaces: Optional['WorkerProcess'] = None
+        # in-flight requests cut off by shutdown_timeout, reported by the worker on exit
+        self.cutoff_requests = 0
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def sentinel(self) -> int:
+        return self.process.sentinel
+
+    @property
+    def uptime(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def send(self, message: str, payload: Any = None):
+        if self.conn is None:
+            return
+        try:
+            self.conn.send((message, payload))
+        except (OSError, EOFError):  # pragma: no cover
+            pass
+
+    def stop(self, timeout: float, respawn: bool = True):
+        """
+        Asks the worker to stop gracefully, it gets killed if still alive after timeout
+        """
+        self.respawn = respawn
+        if self.stopping:
+            return
+        self.stopping = True
+        self.stop_deadline = time.monotonic() + timeout
+        self.send('stop')
+
+    def dump_and_kill(self):
+        """
+        Asks the worker to dump its stack, it gets killed after STACK_DUMP_TIMEOUT
+        """
+        self.hung = True
+        self.stopping = True
+        self.stop_deadline = time.monotonic()
+        if hasattr(signal, 'SIGUSR1'):
+            try:
+                os.kill(self.pid, signal.SIGUSR1)
+            except OSError:  # pragma: no cover
+                return
+            self.stop_deadline += STACK_DUMP_TIMEOUT
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
 
 class Supervisor:
     def __init__(
         self,
-        app: str,
+        app: Union[str, web.Application, Awaitable[web.Application]],
         *,
         sockets: List[BoundSocket],
         config: Config,
         start_method='spawn',
+        startup: Optional[StartupTimeline] = None,
+        on_ready: Optional[Callable[[], Any]] = None,
     ):
         self.app = app
         self.sockets = sockets
         self.config = config
+        # started by serve() before binding sockets
+        self.startup = startup or StartupTimeline()
+        # kept out of the config, which is pickled for spawned workers
+        self.on_ready = on_ready
 
         self.context = multiprocessing.get_context(start_method)
 
+        self.workers: List[WorkerProcess] = []
+        # workers with indexes 0..target_workers - 1 are kept running
+        self.target_workers = config.workers
+        # incremented on every reload, workers of older generations get replaced
+        self.generation = 0
+        self._reloading = False
+        # worker index -> number of consecutive crashes
+        self._failures: Dict[int, int] = {}
+        # worker index -> monotonic time of scheduled respawn
+        self._respawn_at: Dict[int, float] = {}
+        self._memory_checked_at = 0.0
+        self._heartbeats_checked_at = 0.0
+        self.cpu_sets = get_cpu_sets(config.cpu_affinity)
+
+        # an SSLContext can't be passed to spawned processes, forked workers
+        # inherit it with its session ticket keys, so tickets issued by one worker
+        # are accepted by the others
+        self.ssl_context: Optional[ssl.SSLContext] = None
+        self._ssl_context_created_at = 0.0
+        self._ssl_checked_at = 0.0
+        self._ssl_files_mtime = self._get_ssl_files_mtime()
+
+        # responses cached by one worker are served by all of them
+        self.response_cache: Optional[SharedCache] = None
+        if config.response_cache_size:
+            self.response_cache = SharedCache(
+                self.context, config.response_cache_size, config.response_cache_entry_size
+            )
+
+        self.metrics: Optional[MetricsCollector] = None
+        self._metrics_server: Optional[MetricsServer] = None
+        if config.metrics_bind is not None:
+            self.metrics = MetricsCollector()
+            self._metrics_server = MetricsServer(config.metrics_bind, self.render_metrics)
+
+        self._control_server: Optional[ControlServer] = None
+        if config.control_socket is not None:
+            self._control_server = ControlServer(config.control_socket, self._wakeup)
+        # worker pid -> (monotonic time, requests_total) at the previous stats command
+        self._stats_requests: Dict[int, Any] = {}
+        # memory commands waiting for reports: future, pids of workers yet to answer, reports
+        self._memory_requests: List[Tuple[Future, Set[int], Dict[int, Any]]] = []
+
+        self.autoscaler: Optional[Autoscaler] = None
+        self._autoscaled_at = 0.0
+        if config.max_workers is not None:
+            self.autoscaler = Autoscaler(
+                config.min_workers,
+                config.max_workers,
+                metric=config.autoscale_metric,
+                up_threshold=config.autoscale_up_threshold,
+                down_threshold=config.autoscale_down_threshold,
+                cooldown=config.autoscale_cooldown,
+            )
+
+        self._signals: List[int] = []
+        self._wakeup_r: Optional[int] = None
+        self._wakeup_w: Optional[int] = None
+
+        # the new master started on upgrade and the read end of its readiness pipe
+        self._upgrade: Optional[subprocess.Popen] = None
+        self._upgrade_ready_r: Optional[int] = None
+        # set when the new master took over, listening sockets are left to it
+        self.handed_over = False
+        self._ready_notified = False
+
     def run(self):
         signal.signal(signal.SIGTERM, shutdown)
+        self._setup_signals()
 
         logger.info(f'Starting master process [{os.getpid()}]')
-        processes = []
-        for i in range(self.config.workers):
-            process = self.context.Process(
-                target=run_worker,
-                kwargs=dict(app=self.app, sockets=self.sockets, config=self.config),
-            )
-            process.daemon = True
-            process.start()
-            processes.append(process)
+        if self.config.preload_app:
+            # forked workers share the loaded modules with the master (copy-on-write)
+            with self.startup.phase('preload_app'):
+                self.app = load_application(self.app)
+
+        if self.config.is_ssl and self.context.get_start_method() == 'fork':
+            self._create_ssl_context()
+
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        if self._control_server is not None:
+            self._control_server.start()
+
+        for i in range(self.target_workers):
+            self._spawn(i)
 
             if platform.system() == 'Windows':  # pragma: no cover
                 time.sleep(0.1 * random.random())
 
         try:
-            for process in processes:
-                process.join()
+            while True:
+                self._supervise()
         except (SystemExit, KeyboardInterrupt):
             logger.info(f'Stopping master process [{os.getpid()}]')
             pass
         finally:
-            for process in processes:
-                process.terminate()
-                logger.info(f'Finished worker process [{process.pid}]')
+            if not self.handed_over:
+                sd_notify('STOPPING=1')
+            self._stop_workers()
+            self._close_signals()
+            if self._metrics_server is not None:
+                self._metrics_server.stop()
+            if self._control_server is not None:
+                self._control_server.stop()
+            if asyncio.iscoroutine(self.app):
+                self.app.close()  # preloaded app factory, awaited by workers only
 
         logger.info(f'Finished master process [{os.getpid()}]')
+
+    def reload(self):
+        """
+        Replaces all workers one by one with fresh processes,
+        the old worker is stopped only after its replacement is ready to accept connections
+        """
+        self.generation += 1
+        self._reloading = True
+        logger.info(f'Reloading workers (generation {self.generation})')
+        if self.config.preload_app:
+            logger.warning('preload_app is enabled, application code will not be reloaded')
+        if self.ssl_context is not None:
+            self._create_ssl_context()
+        self._reload_next()
+
+    def reload_ssl(self):
+        """
+        Makes workers load certificates from disk for new TLS handshakes,
+        established connections are not affected
+        """
+        if not self.config.is_ssl:
+            return
+        logger.info('Reloading certificates')
+        try:
+            # keeps session ticket keys of the shared context
+            if self.ssl_context is not None:
+                self.config.reload_ssl_context(self.ssl_context)
+            else:
+                self.config.create_ssl_context()  # validates the files
+        except (OSError, ssl.SSLError) as e:
+            logger.error(f'Failed to reload certificates: {e}')
+            return
+        for worker in self.workers:
+            if not worker.stopping:
+                worker.send('reload_ssl')
+
+    def _get_ssl_files_mtime(self) -> Dict[str, Optional[float]]:
+        result: Dict[str, Optional[float]] = {}
+        for path in self.config.ssl_files:
+            try:
+                result[path] = os.stat(path).st_mtime
+            except OSError:
+                result[path] = None
+        return result
+
+    def _check_ssl_files(self):
+        mtime = self._get_ssl_files_mtime()
+        if mtime != self._ssl_files_mtime:
+            self._ssl_files_mtime = mtime
+            self.reload_ssl()
+
+    def scale(self, workers: int):
+        """
+        Starts or gracefully stops workers to have `workers` of them
+        """
+        workers = max(1, workers)
+        if workers == self.target_workers:
+            return
+        logger.info(f'Scaling workers from {self.target_workers} to {workers}')
+        old_target, self.target_workers = self.target_workers, workers
+
+        if workers > old_target:
+            running = {w.index for w in self.workers if not w.stopping}
+            for index in range(old_target, workers):
+                if index not in running and index not in self._respawn_at:
+                    self._spawn(index)
+            return
+
+        for index in range(workers, old_target):
+            self._respawn_at.pop(index, None)
+        for worker in self.workers:
+            if worker.index >= workers:
+                # a replacement that is still starting is not needed either
+                worker.replaces = None
+                worker.stop(self.stop_timeout, respawn=False)
+        self._reload_next()
+
+    def _autoscale(self):
+        workers = [w.metrics for w in self.workers if w.ready and not w.stopping and w.metrics]
+        self.autoscaler.observe(workers)
+        load = self.autoscaler.load
+        target = self.autoscaler.decide(self.target_workers, time.monotonic())
+        if target != self.target_workers:
+            logger.info(f'Autoscaling, {self.config.autoscale_metric} is {load:.3f} per worker')
+            self.scale(target)
+
+    def upgrade(self):
+        """
+        Starts a new master with the same command line and hands the listening sockets over,
+        this master drains its workers and exits once the new one is ready
+        """
+        if self._upgrade is not None:
+            logger.warning('Upgrade is already in progress')
+            return
+        # the new master binds the metrics address and the control socket itself
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+        if self._control_server is not None:
+            self._control_server.stop()
+        try:
+            self._upgrade, self._upgrade_ready_r = start_new_master(self.sockets)
+        except OSError as e:
+            logger.error(f'Failed to start new master process: {e}')
+            self._abort_upgrade()
+            return
+        logger.info(f'Upgrading, started new master process [{self._upgrade.pid}]')
+
+    def _on_upgrade_ready(self):
+        try:
+            data = os.read(self._upgrade_ready_r, 1)
+        except BlockingIOError:  # pragma: no cover
+            return
+        if not data:  # closed without a word, the new master has failed
+            logger.error(f'New master process [{self._upgrade.pid}] failed to start')
+            self._abort_upgrade()
+            return
+        os.close(self._upgrade_ready_r)
+        self._upgrade_ready_r = None
+        self.handed_over = True
+        raise GracefulExit()
+
+    def _abort_upgrade(self):
+        if self._upgrade_ready_r is not None:
+            os.close(self._upgrade_ready_r)
+            self._upgrade_ready_r = None
+        if self._upgrade is not None:
+            if self._upgrade.poll() is None:
+                self._upgrade.kill()
+            self._upgrade.wait()
+            self._upgrade = None
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        if self._control_server is not None:
+            self._control_server.start()
+
+    def _create_ssl_context(self):
+        self.ssl_context = self.config.create_ssl_context()
+        self._ssl_context_created_at = time.monotonic()
+
+    def _rotate_ticket_keys(self):
+        """
+        Replaces workers with ones forked with a new SSLContext, hence new session ticket keys
+        """
+        logger.info('Rotating TLS session ticket keys')
+        self._create_ssl_context()
+        self.generation += 1
+        self._reloading = True
+        self._reload_next()
+
+    def drain(self, pid: int) -> WorkerProcess:
+        """
+        Replaces the worker with a fresh process,
+        the old one is drained once the replacement is ready
+        """
+        for worker in self.workers:
+            if worker.pid == pid and not worker.stopping:
+                break
+        else:
+            raise ControlError(f'No running worker process with pid {pid}')
+        if any(w.replaces is worker for w in self.workers):
+            raise ControlError(f'Worker process [{pid}] is already being replaced')
+        logger.info(f'Draining worker process [{pid}]')
+        new_worker = self._spawn(worker.index)
+        new_worker.replaces = worker
+        return new_worker
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        previous, self._stats_requests = self._stats_requests, {}
+        workers = []
+        for worker in self.workers:
+            stats: Dict[str, Any] = dict(
+                index=worker.index,
+                pid=worker.pid,
+                generation=worker.generation,
+                uptime=round(worker.uptime, 3),
+                rss=get_rss(worker.pid),
+            )
+            if worker.metrics is not None:
+                values = worker.metrics.values
+                requests = values[REQUESTS]
+                # requests per second since the previous stats command
+                checked_at, checked_requests = previous.get(worker.pid, (worker.started_at, 0))
+                elapsed = now - checked_at
+                self._stats_requests[worker.pid] = (now, requests)
+                stats.update(
+                    connections=int(values[CONNECTIONS]),
+                    idle_connections=int(values[IDLE_CONNECTIONS]),
+                    active_requests=int(values[ACTIVE_REQUESTS]),
+                    requests_total=int(requests),
+                    request_rate=(requests - checked_requests) / elapsed if elapsed > 0 else 0.0,
+                    loop_lag=values[LOOP_LAG],
+                    loop_lag_p50=values[LOOP_LAG_P50],
+                    loop_lag_p99=values[LOOP_LAG_P99],
+                    executor_queue_depth=int(values[EXECUTOR_QUEUE_DEPTH]),
+                    executor_active_threads=int(values[EXECUTOR_ACTIVE_THREADS]),
+                )
+            workers.append(stats)
+        return dict(
+            pid=os.getpid(),
+            workers_target=self.target_workers,
+            generation=self.generation,
+            workers=workers,
+        )
+
+    def _on_command(self, name: str, args: List[str]) -> Any:
+        """
+        Executes a command received over the control socket
+        """
+        if name == 'stats' and not args:
+            return self.get_stats()
+        if name == 'workers' and not args:
+            return [
+                dict(
+                    index=w.index,
+                    pid=w.pid,
+                    generation=w.generation,
+                    uptime=round(w.uptime, 3),
+                    ready=w.ready,
+                    stopping=w.stopping,
+                )
+                for w in self.workers
+            ]
+        if name == 'reload' and not args:
+            self.reload()
+            return dict(generation=self.generation)
+        if name == 'scale' and len(args) == 1 and args[0].isdigit():
+            self.scale(int(args[0]))
+            return dict(workers=self.target_workers)
+        if name == 'drain' and len(args) == 1 and args[0].isdigit():
+            new_worker = self.drain(int(args[0]))
+            return dict(pid=int(args[0]), replacement=new_worker.pid)
+        if name == 'memory' and len(args) <= 1 and all(arg.isdigit() for arg in args):
+            return self.get_memory_reports(int(args[0]) if args else None)
+        raise ControlError(
+            f'Unknown command: {" ".join([name] + args)!r}, '
+            f'expected one of: stats, workers, reload, scale <n>, drain <pid>, memory [<pid>]'
+        )
+
+    def get_memory_reports(self, pid: Optional[int] = None) -> Future:
+        """
+        Asks workers for their memory reports, the future is resolved once all of them answer
+        """
+        if not self.config.memory_profiling:
+            raise ControlError('memory_profiling is disabled')
+        workers = [
+            w
+            for w in self.workers
+            if w.ready and not w.stopping and w.conn is not None and pid in (None, w.pid)
+        ]
+        if pid is not None and not workers:
+            raise ControlError(f'No running worker process with pid {pid}')
+
+        future: Future = Future()
+        self._memory_requests.append((future, {w.pid for w in workers}, {}))
+        for worker in workers:
+            worker.send('memory_report')
+        self._resolve_memory_requests()
+        return future
+
+    def _resolve_memory_requests(self):
+        for request in list(self._memory_requests):
+            future, waiting, reports = request
+            if not waiting:
+                self._memory_requests.remove(request)
+                future.set_result([reports[pid] for pid in sorted(reports)])
+
+    def render_metrics(self) -> str:
+        workers = [(w.index, w.metrics) for w in list(self.workers) if w.metrics is not None]
+        return self.metrics.render(workers)
+
+    @property
+    def stop_timeout(self) -> float:
+        return self.config.shutdown_timeout + ACCEPT_GRACE_PERIOD + STOP_TIMEOUT_MARGIN
+
+    def _stop_workers(self):
+        """
+        Drains all workers: each one stops accepting connections and gets
+        shutdown_timeout to finish in-flight requests, then it is killed
+        """
+        self._respawn_at.clear()
+        for worker in self.workers:
+            worker.stop(self.stop_timeout, respawn=False)
+
+        try:
+            while self.workers:
+                now = time.monotonic()
+                for worker in self.workers:
+                    if worker.stop_deadline is not None and worker.stop_deadline <= now:
+                        logger.warning(
+                            f'Worker process [{worker.pid}] failed to stop in time, killing'
+                        )
+                        worker.stop_deadline = None
+                        worker.process.kill()
+
+                deadlines = [w.stop_deadline for w in self.workers if w.stop_deadline is not None]
+                timeout = max(0.0, min(deadlines) - now) if deadlines else None
+
+                waitables: List[Any] = [w.sentinel for w in self.workers]
+                waitables.extend(w.conn for w in self.workers if w.conn is not None)
+                ready = multiprocessing.connection.wait(waitables, timeout=timeout)
+
+                for worker in list(self.workers):
+                    if worker.conn is not None and worker.conn in ready:
+                        self._receive(worker)
+                    if not worker.process.is_alive():
+                        self._on_worker_exit(worker)
+        except (SystemExit, KeyboardInterrupt):
+            # interrupted once more, don't wait any longer
+            for worker in self.workers:
+                worker.process.kill()
+                worker.process.join()
+                worker.close()
+                logger.info(f'Killed worker process [{worker.pid}]')
+            self.workers.clear()
+
+    def _spawn(self, index: int) -> WorkerProcess:
+        conn, child_conn = self.context.Pipe()
+        # the autoscaler and the stats command read the load from worker metrics
+        need_metrics = (
+            self.metrics is not None
+            or self.autoscaler is not None
+            or self._control_server is not None
+        )
+        metrics = WorkerMetrics() if need_metrics else None
+        heartbeat = None
+        if self.config.worker_timeout is not None:
+            heartbeat = RawValue(ctypes.c_double, time.monotonic())
+        cpus = self.cpu_sets[index % len(self.cpu_sets)] if self.cpu_sets else None
+        process = self.context.Process(
+            target=run_worker,
+            kwargs=dict(
+                app=self.app,
+                sockets=self.sockets,
+                config=self.config,
+                conn=child_conn,
+                metrics=metrics,
+                cpus=cpus,
+                ssl_context=self.ssl_context,
+                heartbeat=heartbeat,
+                response_cache=self.response_cache,
+            ),
+        )
+        process.daemon = True
+        spawned_at = time.monotonic()
+        process.start()
+        child_conn.close()
+
+        worker = WorkerProcess(process, conn, index, self.generation, metrics, heartbeat)
+        worker.started_at = spawned_at
+        self.workers.append(worker)
+        return worker
+
+    def _setup_signals(self):
+        if not hasattr(signal, 'SIGHUP'):  # pragma: no cover
+            return
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        for sig in MASTER_SIGNALS:
+            signal.signal(sig, self._on_signal)
+
+    def _close_signals(self):
+        if self._wakeup_r is not None:
+            for sig in MASTER_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            os.close(self._wakeup_r)
+            os.close(self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = None
+
+    def _on_signal(self, sig, frame):  # noqa
+        # the actual handling is deferred to the supervise loop
+        self._signals.append(sig)
+        self._wakeup()
+
+    def _wakeup(self):
+        # the pipe wakes up the supervise loop, safe to call from signal handlers and threads
+        if self._wakeup_w is None:  # pragma: no cover
+            return
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:  # pragma: no cover
+            pass
+
+    def _handle_signals(self):
+        try:
+            while os.read(self._wakeup_r, 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+        signals, self._signals = self._signals, []
+        for sig in signals:
+            if sig == signal.SIGHUP:
+                self.reload()
+            elif sig == signal.SIGUSR1:
+                self.reload_ssl()
+            elif sig == signal.SIGUSR2:
+                self.upgrade()
+            elif sig == signal.SIGTTIN:
+                self.scale(self.target_workers + 1)
+            elif sig == signal.SIGTTOU:
+                self.scale(self.target_workers - 1)
+
+    def _supervise(self):
+        waitables: List[Any] = [w.sentinel for w in self.workers]
+        waitables.extend(w.conn for w in self.workers if w.conn is not None)
+        if self._wakeup_r is not None:
+            waitables.append(self._wakeup_r)
+        if self._upgrade_ready_r is not None:
+            waitables.append(self._upgrade_ready_r)
+
+        ready = multiprocessing.connection.wait(waitables, timeout=self._get_wait_timeout())
+
+        if self._wakeup_r in ready:
+            self._handle_signals()
+            if self._control_server is not None:
+                self._control_server.process(self._on_command)
+
+        if self._upgrade_ready_r is not None and self._upgrade_ready_r in ready:
+            self._on_upgrade_ready()
+        elif self._upgrade is not None and self._upgrade.poll() is not None:
+            # its forked workers may keep the readiness pipe open
+            logger.error(
+                f'New master process [{self._upgrade.pid}] exited '
+                f'with code {self._upgrade.returncode}'
+            )
+            self._abort_upgrade()
+
+        for worker in list(self.workers):
+            if worker.conn is not None and worker.conn in ready:
+                self._receive(worker)
+
+        for worker in list(self.workers):
+            if not worker.process.is_alive():
+                self._on_worker_exit(worker)
+
+        now = time.monotonic()
+        for index, respawn_at in list(self._respawn_at.items()):
+            if respawn_at <= now:
+                del self._respawn_at[index]
+                self._spawn(index)
+
+        if self.config.worker_timeout is not None:
+            if now - self._heartbeats_checked_at >= self._heartbeat_interval:
+                self._heartbeats_checked_at = now
+                self._check_heartbeats(now)
+
+        for worker in self.workers:
+            if worker.stop_deadline is not None and worker.stop_deadline <= now:
+                if not worker.hung:
+                    logger.warning(
+                        f'Worker process [{worker.pid}] failed to stop in time, killing'
+                    )
+                worker.stop_deadline = None
+                worker.process.kill()
+
+        if self.config.max_memory_rss and now - self._memory_checked_at >= MEMORY_CHECK_INTERVAL:
+            self._memory_checked_at = now
+            self._check_memory()
+
+        if self.autoscaler is not None:
+            if now - self._autoscaled_at >= self.config.autoscale_interval:
+                self._autoscaled_at = now
+                self._autoscale()
+
+        watch_interval = self.config.ssl_watch_interval
+        if watch_interval is not None and now - self._ssl_checked_at >= watch_interval:
+            self._ssl_checked_at = now
+            self._check_ssl_files()
+
+        if self._ticket_key_rotation_at is not None and self._ticket_key_rotation_at <= now:
+            self._rotate_ticket_keys()
+
+    @property
+    def _ticket_key_rotation_at(self) -> Optional[float]:
+        if self.ssl_context is None or not self.config.ssl_ticket_key_rotation:
+            return None
+        return self._ssl_context_created_at + self.config.ssl_ticket_key_rotation
+
+    @property
+    def _heartbeat_interval(self) -> float:
+        return get_heartbeat_interval(self.config.worker_timeout)
+
+    def _get_wait_timeout(self) -> Optional[float]:
+        deadlines = list(self._respawn_at.values())
+        if self.config.worker_timeout is not None:
+            deadlines.append(self._heartbeats_checked_at + self._heartbeat_interval)
+        deadlines.extend(w.stop_deadline for w in self.workers if w.stop_deadline is not None)
+        if self.config.max_memory_rss:
+            deadlines.append(self._memory_checked_at + MEMORY_CHECK_INTERVAL)
+        if self.config.ssl_watch_interval is not None:
+            deadlines.append(self._ssl_checked_at + self.config.ssl_watch_interval)
+        if self._ticket_key_rotation_at is not None:
+            deadlines.append(self._ticket_key_rotation_at)
+        if self._upgrade is not None:
+            deadlines.append(time.monotonic() + UPGRADE_CHECK_INTERVAL)
+        if self.autoscaler is not None:
+            deadlines.append(self._autoscaled_at + self.config.autoscale_interval)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def _receive(self, worker: WorkerProcess):
+        while worker.conn is not None and worker.conn.poll():
+            try:
+                message, payload = worker.conn.recv()
+            except (OSError, EOFError):
+                # the process is dead or dying, its sentinel will tell
+                worker.close()
+                return
+            self._on_message(worker, message, payload)
+
+    def _on_message(self, worker: WorkerProcess, message: str, payload: Any):
+        if message == 'ready':
+            worker.ready = True
+            # the monotonic clock is shared by processes
+            worker.startup_phases = dict(
+                spawn=max(0.0, payload['started_at'] - worker.started_at), **payload['phases']
+            )
+            logger.debug(
+                f'Worker process [{worker.pid}] is ready in {worker.uptime:.3f}s: '
+                f'{format_phases(worker.startup_phases)}'
+            )
+            if not self._ready_notified:
+                # all workers listen before anyone is told the server is up
+                if sum(w.ready for w in self.workers) >= self.target_workers:
+                    self._ready_notified = True
+                    self._log_startup()
+                    notify_ready(self.config, self.on_ready)
+            if worker.replaces is not None:
+                old, worker.replaces = worker.replaces, None
+                logger.info(f'Worker process [{worker.pid}] replaces [{old.pid}]')
+                old.stop(self.stop_timeout, respawn=False)
+                self._reload_next()
+        elif message == 'stopped':
+            worker.cutoff_requests = payload['cutoff_requests']
+        elif message == 'memory_report':
+            for _, waiting, reports in self._memory_requests:
+                if worker.pid in waiting:
+                    waiting.discard(worker.pid)
+                    reports[worker.pid] = payload
+            self._resolve_memory_requests()
+        else:  # pragma: no cover
+            logger.warning(f'Unknown message from worker process [{worker.pid}]: {message!r}')
+
+    def _log_startup(self):
+        ready = [w for w in self.workers if w.ready]
+        slowest = max(ready, key=lambda w: sum(w.startup_phases.values()))
+        master_phases = f'{self.startup}, ' if self.startup.phases else ''
+        logger.info(
+            f'All {len(ready)} worker processes are ready in {self.startup.elapsed:.3f}s: '
+            f'{master_phases}slowest worker [{slowest.pid}] '
+            f'{format_phases(slowest.startup_phases)}'
+        )
+
+    def _reload_next(self):
+        if not self._reloading:
+            return
+        if any(w.replaces is not None for w in self.workers):
+            return  # one replacement at a time
+
+        for worker in self.workers:
+            if worker.generation < self.generation and not worker.stopping:
+                new_worker = self._spawn(worker.index)
+                new_worker.replaces = worker
+                return
+
+        self._reloading = False
+        logger.info('Workers reloaded')
+
+    def _on_worker_exit(self, worker: WorkerProcess):
+        self._receive(worker)  # the last messages may still be in the pipe
+        self.workers.remove(worker)
+        if self._memory_requests:
+            for _, waiting, _ in self._memory_requests:
+                waiting.discard(worker.pid)
+            self._resolve_memory_requests()
+        if self.metrics is not None:
+            self.metrics.retire(worker.index, worker.metrics)
+        worker.process.join()
+        worker.close()
+        exitcode = worker.process.exitcode
+
+        if worker.replaces is not None:
+            logger.error(
+                f'Worker process [{worker.pid}] died (exit code {exitcode}) before it was ready, '
+                f'reload aborted'
+            )
+            self._reloading = False
+            old = worker.replaces
+            if old not in self.workers:
+                # the old one is gone as well, fill its slot
+                self._respawn_at[old.index] = time.monotonic()
+            return
+
+        if not worker.respawn or worker.index >= self.target_workers:
+            if worker.cutoff_requests:
+                logger.info(
+                    f'Finished worker process [{worker.pid}] '
+                    f'({worker.cutoff_requests} requests cut off)'
+                )
+            else:
+                logger.info(f'Finished worker process [{worker.pid}]')
+            return
+
+        if any(w.replaces is worker for w in self.workers):
+            logger.error(
+                f'Worker process [{worker.pid}] died (exit code {exitcode}), '
+                f'its replacement is already starting'
+            )
+            return
+
+        if (worker.stopping and not worker.hung) or exitcode == 0:
+            logger.info(f'Worker process [{worker.pid}] exited, restarting')
+            self._failures.pop(worker.index, None)
+            delay = 0.0
+        elif worker.uptime >= WORKER_MIN_UPTIME:
+            logger.error(f'Worker process [{worker.pid}] died (exit code {exitcode}), restarting')
+            self._failures.pop(worker.index, None)
+            delay = 0.0
+        else:
+            failures = self._failures.get(worker.index, 0) + 1
+            self._failures[worker.index] = failures
+            delay = min(RESPAWN_BACKOFF_MIN * 2 ** (failures - 1), RESPAWN_BACKOFF_MAX)
+            logger.error(
+                f'Worker process [{worker.pid}] died (exit code {exitcode}) '
+                f'{worker.uptime:.1f}s after start, restarting in {delay:.1f}s'
+            )
+
+        self._respawn_at[worker.index] = time.monotonic() + delay
+
+    def _check_heartbeats(self, now: float):
+        for worker in self.workers:
+            # a worker starts sending heartbeats before it is ready,
+            # a stopping one is killed after stop_timeout anyway
+            if worker.heartbeat is None or not worker.ready or worker.stopping:
+                continue
+            silence = now - worker.heartbeat.value
+            if silence > self.config.worker_timeout:
+                logger.error(
+                    f'Worker process [{worker.pid}] missed heartbeats for {silence:.1f}s '
+                    f'(worker_timeout={self.config.worker_timeout}), dumping its stack and killing'
+                )
+                worker.dump_and_kill()
+
+    def _check_memory(self):
+        for worker in self.workers:
+            if worker.stopping:
+                continue
+            rss = get_rss(worker.pid)
+            if rss is not None and rss > self.config.max_memory_rss:
+                logger.warning(
+                    f'Worker process [{worker.pid}] uses {rss} bytes of memory '
+                    f'(max_memory_rss={self.config.max_memory_rss}), restarting'
+                )
+                if self.config.memory_profiling:
+                    # what has grown is lost with the process otherwise
+                    worker.send('dump_memory')
+                worker.stop(self.stop_timeout)
@@ -0,0 +1,71 @@
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from ._config import BoundSocket
+from ._logging import logger
+
+# bind url -> file descriptors of listening sockets passed to the new master
+UPGRADE_FDS_ENV = 'AIOHTTP_SERVE_FDS'
+# write end of a pipe the new master closes when its workers are ready
+UPGRADE_READY_FD_ENV = 'AIOHTTP_SERVE_READY_FD'
+
+
+def pop_inherited_fds() -> Dict[str, List[int]]:
+    """
+    Returns sockets passed by the previous master on binary upgrade
+    """
+    value = os.environ.pop(UPGRADE_FDS_ENV, None)
+    if not value:
+        return {}
+    return json.loads(value)
+
+
+def start_new_master(sockets: List[BoundSocket]) -> Tuple[subprocess.Popen, int]:
+    """
+    Starts the same command line with the listening sockets passed down,
+    returns the process and the read end of its readiness pipe
+    """
+    fds: Dict[str, List[int]] = {}
+    for s in sockets:
+        fds.setdefault(s.info.source, []).append(s.socket.fileno())
+
+    ready_r, ready_w = os.pipe()
+    env = dict(os.environ)
+    env[UPGRADE_FDS_ENV] = json.dumps(fds)
+    env[UPGRADE_READY_FD_ENV] = str(ready_w)
+
+    # orig_argv keeps interpreter options and "-m module"
+    argv = list(getattr(sys, 'orig_argv', None) or [sys.executable] + sys.argv)
+    argv[0] = sys.executable
+    try:
+        process = subprocess.Popen(
+            argv,
+            env=env,
+            pass_fds=[ready_w] + [s.socket.fileno() for s in sockets],
+        )
+    except Exception:
+        os.close(ready_r)
+        raise
+    finally:
+        os.close(ready_w)
+    return process, ready_r
+
+
+def notify_upgrade_ready() -> bool:
+    """
+    Tells the previous master that this one is serving, so it can stop.
+    Returns False if this master was not started by binary upgrade
+    """
+    fd = os.environ.pop(UPGRADE_READY_FD_ENV, None)
+    if fd is None:
+        return False
+    logger.info(f'Master process [{os.getpid()}] is ready, stopping the old one')
+    try:
+        os.write(int(fd), b'1')
+        os.close(int(fd))
+    except OSError:  # pragma: no cover
+        pass
+    return True
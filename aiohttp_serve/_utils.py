@@ -1,10 +1,15 @@
+import glob
+import os
 import sys
 from importlib import import_module
+from itertools import zip_longest
 from pathlib import Path
-from typing import Union, Awaitable
+from typing import Union, Awaitable, Optional, List, Set, Sequence
 
 from aiohttp import web
 
+from ._logging import logger
+
 
 class NoAppError(Exception):
     pass
@@ -44,3 +49,71 @@ def load_application(
         return eval(app_name, vars(module))
     except NameError:  # pragma: no cover
         raise NoAppError()
+
+
+def get_rss(pid: int) -> Optional[int]:
+    """
+    Returns resident set size of the process in bytes
+    or None if it can't be determined (non-Linux platforms, dead process)
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def parse_cpu_list(text: str) -> Set[int]:
+    """
+    Parses cpu list format of sysfs and cpusets, e.g. "0-3,8,10-11"
+    """
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def get_numa_nodes() -> List[Set[int]]:
+    """
+    Returns cpus of every NUMA node, empty list if the topology is unknown
+    """
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+        try:
+            with open(path) as f:
+                cpus = parse_cpu_list(f.read())
+        except (OSError, ValueError):  # pragma: no cover
+            return []
+        if cpus:
+            nodes.append(cpus)
+    return nodes
+
+
+def get_cpu_sets(cpu_affinity: Union[None, str, Sequence]) -> Optional[List[Set[int]]]:
+    """
+    Returns cpus every worker index is pinned to, worker `i` gets `cpu_sets[i % len(cpu_sets)]`.
+    'auto' gives every worker a single cpu, consecutive workers are placed
+    on different NUMA nodes so the load is spread between them
+    """
+    if cpu_affinity is None or not hasattr(os, 'sched_getaffinity'):  # pragma: no cover
+        return None
+
+    if cpu_affinity != 'auto':
+        return [{item} if isinstance(item, int) else set(item) for item in cpu_affinity]
+
+    available = os.sched_getaffinity(0)
+    nodes = [sorted(cpus & available) for cpus in get_numa_nodes()]
+    nodes = [cpus for cpus in nodes if cpus] or [sorted(available)]
+    order = [cpu for group in zip_longest(*nodes) for cpu in group if cpu is not None]
+    return [{cpu} for cpu in order]
+
+
+def set_cpu_affinity(cpus: Optional[Set[int]]):
+    if cpus is None:
+        return
+    os.sched_setaffinity(0, cpus)
+    logger.info(f'Worker process [{os.getpid()}] is pinned to cpus {sorted(cpus)}')
@@ -1,15 +1,60 @@
 import asyncio
+import ctypes
+import multiprocessing
 import os
 import platform
+import random
+import signal
+import socket
+import ssl
 import sys
-from typing import Union, Awaitable, List
+import threading
+import time
+from multiprocessing.connection import Connection
+from typing import Union, Awaitable, List, Optional, Any, Callable
 
 from aiohttp import web
+from aiohttp.web_runner import GracefulExit
 
 from ._config import Config, BoundSocket
-from ._logging import logger
+from ._logging import logger, get_handlers, QueueLogging
+from ._metrics import (
+    WorkerMetrics,
+    ACTIVE_REQUESTS,
+    CONNECTIONS,
+    IDLE_CONNECTIONS,
+    REAPED_CONNECTIONS,
+    RESPONSE_CACHE_HITS,
+    RESPONSE_CACHE_MISSES,
+    LOOP_LAG,
+    LOOP_LAG_BUCKETS,
+    LOOP_LAG_P50,
+    LOOP_LAG_P99,
+    SLOW_CALLBACKS,
+    REJECTED_CONNECTIONS,
+    EXECUTOR_TASKS,
+    EXECUTOR_QUEUE_DEPTH,
+    EXECUTOR_ACTIVE_THREADS,
+)
+from ._executor import WorkerExecutor
+from ._keepalive import KeepaliveReaper, count_idle, KEEPALIVE_CHECK_INTERVAL
+from ._static import FileCache, mount_static
+from ._cache import SharedCache, ResponseCache
+from ._limits import ConnectionLimiter, LimitedSockSite
+from ._monitor import LoopMonitor
+from ._profiling import MemoryProfiler
 from ._utils import load_application
-from ._socket import share_socket
+from ._socket import bind_socket, share_socket
+from ._startup import StartupTimeline, notify_ready, sd_notify
+
+ACCEPT_GRACE_PERIOD = 0.1
+METRICS_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 1.0
+
+
+def get_heartbeat_interval(worker_timeout: float) -> float:
+    # several heartbeats fit into worker_timeout, so a late one is not fatal
+    return min(HEARTBEAT_INTERVAL, worker_timeout / 4)
 
 
 class Worker:
@@ -19,16 +64,120 @@ class Worker:
         *,
         sockets: List[BoundSocket],
         config: Config,
+        conn: Optional[Connection] = None,
+        metrics: Optional[WorkerMetrics] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+        heartbeat: Optional[ctypes.c_double] = None,
+        response_cache: Optional[SharedCache] = None,
+        startup: Optional[StartupTimeline] = None,
+        on_ready: Optional[Callable[[], Any]] = None,
     ):
-        self.app = load_application(app)
+        # started by serve() for a single process, phases are reported to the master otherwise
+        self.startup = startup or StartupTimeline()
+        # called once listening, only without a master process
+        self.on_ready = on_ready
+        with self.startup.phase('load_application'):
+            self.app = load_application(app)
         self.sockets = sockets
         self.config = config
+        self.conn = conn
+        self.metrics = metrics
+        # created by the master to share session ticket keys between forked workers
+        self.ssl_context = ssl_context
+        # time.monotonic() of the last heartbeat, read by the master to detect a hung loop
+        self.heartbeat = heartbeat
+        # shared by all workers, created by the master
+        self.response_cache = response_cache
         self.loop: asyncio.AbstractEventLoop = None  # type: ignore
+        self.loop_monitor: Optional[LoopMonitor] = None
+        self.memory_profiler: Optional[MemoryProfiler] = None
+        # the last dump requested, the master asks for one right before recycling the worker
+        self._memory_dump: Optional[asyncio.Future] = None
+        self.executor: Optional[WorkerExecutor] = None
+        self.keepalive_reaper: Optional[KeepaliveReaper] = None
+        self.response_cache_middleware: Optional[ResponseCache] = None
+        # executor threads didn't finish within executor_shutdown_timeout
+        self.executor_abandoned = False
+
+        self.requests_count = 0
+        self.max_requests = None
+        if config.max_requests:
+            self.max_requests = config.max_requests + random.randint(
+                0, config.max_requests_jitter
+            )
+        self._stop_event: asyncio.Event = None  # type: ignore
+
+        self.active_requests = 0
+        # requests cancelled because they didn't finish within shutdown_timeout
+        self.cutoff_requests = 0
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop_event is not None and self._stop_event.is_set()
+
+    def stop(self):
+        """
+        Stops the worker gracefully: listening sockets are closed
+        and in-flight requests are given shutdown_timeout to finish
+        """
+        if self._stop_event is not None and not self._stop_event.is_set():
+            logger.info(f'Stopping worker process [{os.getpid()}]')
+            self._stop_event.set()
+
+    def reload_ssl(self):
+        """
+        Loads certificates from disk, established connections keep the old ones
+        """
+        if self.ssl_context is None:
+            return
+        try:
+            self.config.reload_ssl_context(self.ssl_context)
+        except (OSError, ssl.SSLError) as e:
+            logger.error(f'Worker process [{os.getpid()}] failed to reload certificates: {e}')
+            return
+        logger.info(f'Worker process [{os.getpid()}] reloaded certificates')
+
+    def dump_memory(self):
+        """
+        Writes a memory report of the worker to memory_profiling_dir,
+        the snapshot is taken in the executor like the periodic samples
+        """
+        if self.memory_profiler is None:
+            return
+        self._memory_dump = self.loop.run_in_executor(None, self._write_memory_dump)
+
+    def _write_memory_dump(self):
+        try:
+            self.memory_profiler.dump(self.config.memory_profiling_dir)
+        except OSError as e:
+            logger.error(f'Worker process [{os.getpid()}] failed to dump memory report: {e}')
 
     def run(self):
         logger.info(f'Starting worker process [{os.getpid()}]')
 
+        if self.config.memory_profiling:
+            # started before the loop, so the application startup is the baseline
+            self.memory_profiler = MemoryProfiler(self.config.memory_profiling_frames)
+            self.memory_profiler.start()
+
         self.loop = self._setup_loop()
+        self._stop_event = asyncio.Event()
+
+        if self.config.executor_threads:
+            self.executor = WorkerExecutor(self.config.executor_threads)
+            self.loop.set_default_executor(self.executor)
+
+        if self.conn is not None:
+            threading.Thread(target=self._read_messages, daemon=True).start()
+
+        if self.config.handle_signals:
+            self._setup_signals()
+
+        access_log_queue = self._setup_access_log_queue()
+
+        if self.config.loop_monitor:
+            self.loop_monitor = LoopMonitor(self.loop, self.config.slow_callback_threshold)
+            self.loop_monitor.start()
 
         main_task = self.loop.create_task(self._run_app())
         try:
@@ -37,7 +186,15 @@ class Worker:
             logger.info(f'Stopping worker process [{os.getpid()}]')
             pass
         finally:
+            if self.conn is None:
+                sd_notify('STOPPING=1')
+            if self.loop_monitor is not None:
+                self.loop_monitor.stop()
+            if self.memory_profiler is not None:
+                self.memory_profiler.stop()
             self._shutdown()
+            if access_log_queue is not None:
+                access_log_queue.stop()
 
     async def _run_app(self):
         app = self.app
@@ -45,22 +202,57 @@ class Worker:
         sockets = self.sockets
 
         if asyncio.iscoroutine(app):
-            app = await app  # type: ignore[misc]
+            with self.startup.phase('app_factory'):
+                app = await app  # type: ignore[misc]
+
+        app.middlewares.insert(0, self._create_middleware())
+
+        if config.response_cache_size:
+            cache = self.response_cache
+            if cache is None:
+                cache = SharedCache(
+                    multiprocessing.get_context(),
+                    config.response_cache_size,
+                    config.response_cache_entry_size,
+                )
+            self.response_cache_middleware = ResponseCache(
+                cache, config.response_cache_ttl, config.response_cache_vary
+            )
+            # hits are counted by the metrics middleware but skip the application ones
+            app.middlewares.insert(1, self.response_cache_middleware.middleware)
+
+        static_cache: Optional[FileCache] = None
+        if config.static:
+            static_cache = FileCache(config.static_cache_size, config.static_cache_ttl)
+            mount_static(app, config.static, static_cache)
 
         runner = web.AppRunner(
             app,
-            handle_signals=config.handle_signals,
             access_log_class=config.access_log_class,
             access_log_format=config.access_log_format,
             access_log=config.access_log,
             keepalive_timeout=config.keepalive_timeout,
         )
 
-        await runner.setup()
+        with self.startup.phase('runner_setup'):
+            await runner.setup()
 
-        ssl_context = config.create_ssl_context()
+        ssl_context = self.ssl_context = self.ssl_context or config.create_ssl_context()
+
+        limiter: Optional[ConnectionLimiter] = None
+        if config.max_connections_per_worker:
+            limiter = ConnectionLimiter(
+                config.max_connections_per_worker,
+                config.overload_policy,
+                on_reject=self._on_reject,
+            )
 
         sites: List[web.BaseSite] = []
+        own_sockets: List[socket.socket] = []
+        sample_task: Optional[asyncio.Future] = None
+        heartbeat_task: Optional[asyncio.Future] = None
+        memory_task: Optional[asyncio.Future] = None
+        reaper_task: Optional[asyncio.Future] = None
         try:
             for s in sockets:
                 is_ssl = s.info.is_ssl
@@ -71,21 +263,59 @@ class Worker:
                     )
 
                 sock = s.socket
-                if config.workers > 1 and platform.system() == 'Windows':  # pragma: no cover
+                if config.use_supervisor and platform.system() == 'Windows':  # pragma: no cover
                     sock = share_socket(s.socket)
 
-                sites.append(
-                    web.SockSite(
-                        runner,
-                        sock,
-                        shutdown_timeout=config.shutdown_timeout,
-                        ssl_context=ssl_context if is_ssl else None,
-                        backlog=config.backlog,
-                    )
+                # each worker listens on its own SO_REUSEPORT socket,
+                # so the kernel balances incoming connections between workers
+                if (
+                    config.reuse_port
+                    and config.use_supervisor
+                    and not s.info.is_unix_socket
+                    and not s.info.is_fd
+                ):
+                    sock = bind_socket(s.info, reuse_port=True)
+                    own_sockets.append(sock)
+
+                site_kwargs = dict(
+                    shutdown_timeout=config.shutdown_timeout,
+                    ssl_context=ssl_context if is_ssl else None,
+                    backlog=s.info.backlog or config.backlog,
                 )
+                if limiter is not None:
+                    sites.append(LimitedSockSite(runner, sock, limiter=limiter, **site_kwargs))
+                else:
+                    sites.append(web.SockSite(runner, sock, **site_kwargs))
 
-            for site in sites:
-                await site.start()
+            with self.startup.phase('site_start'):
+                for site in sites:
+                    await site.start()
+
+            if self.metrics is not None:
+                sample_task = asyncio.ensure_future(self._sample_metrics(runner.server))
+            if self.heartbeat is not None:
+                heartbeat_task = asyncio.ensure_future(self._send_heartbeats())
+            if self.memory_profiler is not None:
+                memory_task = asyncio.ensure_future(self._sample_memory())
+            if config.adaptive_keepalive:
+                self.keepalive_reaper = KeepaliveReaper(
+                    config.keepalive_timeout,
+                    config.keepalive_min_timeout,
+                    config.keepalive_pressure_threshold,
+                    max_connections=config.max_connections_per_worker,
+                    max_memory_rss=config.max_memory_rss,
+                )
+                reaper_task = asyncio.ensure_future(self._reap_idle_connections(runner.server))
+            self._send(
+                'ready',
+                dict(started_at=self.startup.started_at, phases=self.startup.phases),
+            )
+            if self.conn is None:
+                logger.info(
+                    f'Worker process [{os.getpid()}] is ready '
+                    f'in {self.startup.elapsed:.3f}s: {self.startup}'
+                )
+                notify_ready(config, self.on_ready)
 
             # sleep forever by 1 hour intervals,
             # on Windows before Python 3.8 wake up every 1 second to handle
@@ -95,10 +325,228 @@ class Worker:
             else:
                 delay = 3600
 
-            while True:
-                await asyncio.sleep(delay)
+            while not self._stop_event.is_set():
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
         finally:
+            if sample_task is not None:
+                sample_task.cancel()
+            if heartbeat_task is not None:
+                heartbeat_task.cancel()
+            if memory_task is not None:
+                memory_task.cancel()
+            if reaper_task is not None:
+                reaper_task.cancel()
+            if limiter is not None:
+                limiter.close()
+
+            # stop accepting first and give connections accepted right before that
+            # a moment to register and read their request, otherwise
+            # runner.cleanup() drops them without a response
+            for site in list(runner.sites):
+                await site.stop()
+            await asyncio.sleep(ACCEPT_GRACE_PERIOD)
+
             await runner.cleanup()
+            for sock in own_sockets:
+                sock.close()
+            if static_cache is not None:
+                static_cache.close()
+
+            if self.cutoff_requests:
+                logger.warning(
+                    f'Worker process [{os.getpid()}] cut off {self.cutoff_requests} '
+                    f'in-flight requests after shutdown_timeout ({config.shutdown_timeout}s)'
+                )
+            self._send('stopped', dict(cutoff_requests=self.cutoff_requests))
+
+    def _on_reject(self):
+        if self.metrics is not None:
+            self.metrics.add(REJECTED_CONNECTIONS)
+
+    def _send(self, message: str, payload: Any = None):
+        if self.conn is None:
+            return
+        try:
+            self.conn.send((message, payload))
+        except (OSError, EOFError):  # pragma: no cover
+            logger.warning(f'Worker process [{os.getpid()}] lost connection to master')
+
+    def _read_messages(self):
+        # runs in a separate thread, so the master can reach
+        # the worker even if its event loop is busy
+        while True:
+            try:
+                message, payload = self.conn.recv()
+            except (OSError, EOFError):
+                break
+            try:
+                self.loop.call_soon_threadsafe(self._on_message, message, payload)
+            except RuntimeError:  # pragma: no cover
+                break  # loop is closed
+
+    def _on_message(self, message: str, payload: Any):
+        if message == 'stop':
+            self.stop()
+        elif message == 'reload_ssl':
+            self.reload_ssl()
+        elif message == 'memory_report':
+            asyncio.ensure_future(self._send_memory_report())
+        elif message == 'dump_memory':
+            self.dump_memory()
+        else:  # pragma: no cover
+            logger.warning(f'Unknown message from master: {message!r}')
+
+    def _create_middleware(self):
+        @web.middleware
+        async def middleware(request, handler):
+            self.requests_count += 1
+            if self.max_requests is not None and self.requests_count == self.max_requests:
+                logger.info(
+                    f'Max requests ({self.max_requests}) reached, '
+                    f'restarting worker process [{os.getpid()}]'
+                )
+                self.stop()
+
+            metrics = self.metrics
+            self.active_requests += 1
+            if metrics is not None:
+                metrics.set(ACTIVE_REQUESTS, self.active_requests)
+
+            started = self.loop.time()
+            response = None
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status
+                return response
+            except web.HTTPException as e:
+                response = e
+                status = e.status
+                raise
+            except asyncio.CancelledError:
+                status = 0
+                if self.stopping:
+                    self.cutoff_requests += 1
+                raise
+            finally:
+                self.active_requests -= 1
+                if metrics is not None:
+                    metrics.set(ACTIVE_REQUESTS, self.active_requests)
+                    metrics.observe_request(
+                        status,
+                        self.loop.time() - started,
+                        request.content_length or 0,
+                        _get_body_size(response),
+                    )
+
+        return middleware
+
+    async def _sample_metrics(self, server: web.Server):
+        metrics = self.metrics
+        while True:
+            started = self.loop.time()
+            await asyncio.sleep(METRICS_INTERVAL)
+            lag = max(0.0, self.loop.time() - started - METRICS_INTERVAL)
+            metrics.set(LOOP_LAG, lag)
+            metrics.observe('loop_lag_sample_seconds', LOOP_LAG_BUCKETS, lag)
+            metrics.set(CONNECTIONS, len(server.connections))
+            metrics.set(IDLE_CONNECTIONS, count_idle(server))
+            if self.keepalive_reaper is not None:
+                metrics.set(REAPED_CONNECTIONS, self.keepalive_reaper.reaped)
+            if self.response_cache_middleware is not None:
+                metrics.set(RESPONSE_CACHE_HITS, self.response_cache_middleware.hits)
+                metrics.set(RESPONSE_CACHE_MISSES, self.response_cache_middleware.misses)
+
+            if self.loop_monitor is not None:
+                p50, p99 = self.loop_monitor.get_lag()
+                metrics.set(LOOP_LAG_P50, p50)
+                metrics.set(LOOP_LAG_P99, p99)
+                metrics.set(SLOW_CALLBACKS, self.loop_monitor.slow_callbacks_count)
+
+            executor = self.executor
+            if executor is not None:
+                metrics.set(EXECUTOR_TASKS, executor.tasks)
+                metrics.set(EXECUTOR_QUEUE_DEPTH, executor.queued)
+                metrics.set(EXECUTOR_ACTIVE_THREADS, executor.active)
+                metrics.set_histogram(
+                    'executor_wait_seconds', executor.wait_counts, executor.wait_total
+                )
+
+    async def _send_heartbeats(self):
+        interval = get_heartbeat_interval(self.config.worker_timeout)
+        while True:
+            self.heartbeat.value = time.monotonic()
+            await asyncio.sleep(interval)
+
+    async def _reap_idle_connections(self, server: web.Server):
+        while True:
+            await asyncio.sleep(KEEPALIVE_CHECK_INTERVAL)
+            self.keepalive_reaper.check(server, self.loop.time())
+
+    async def _sample_memory(self):
+        # taking a snapshot of a big heap takes a while, it runs in a thread
+        while True:
+            await asyncio.sleep(self.config.memory_profiling_interval)
+            await self.loop.run_in_executor(None, self.memory_profiler.sample)
+
+    async def _send_memory_report(self):
+        report = None
+        if self.memory_profiler is not None:
+            report = await self.loop.run_in_executor(None, self.memory_profiler.report)
+        self._send('memory_report', report)
+
+    def _setup_access_log_queue(self) -> Optional[QueueLogging]:
+        # access log lines are written by a background thread,
+        # so slow stdout or disk doesn't stall the event loop
+        config = self.config
+        if not config.async_access_log or config.access_log is None:
+            return None
+        if not get_handlers(config.access_log):
+            return None
+        access_log_queue = QueueLogging(
+            config.access_log,
+            config.access_log_queue_size,
+            block=config.access_log_queue_policy == 'block',
+        )
+        access_log_queue.start()
+        return access_log_queue
+
+    def _setup_signals(self):
+        # the first SIGINT/SIGTERM drains the worker, the second one stops it immediately
+        def handler():
+            if self.stopping:
+                raise GracefulExit()
+            self.stop()
+
+        try:
+            self.loop.add_signal_handler(signal.SIGINT, handler)
+            self.loop.add_signal_handler(signal.SIGTERM, handler)
+            if self.conn is None and hasattr(signal, 'SIGUSR1'):
+                # no master process to reload certificates, like it does on SIGUSR1
+                self.loop.add_signal_handler(signal.SIGUSR1, self.reload_ssl)
+            if self.memory_profiler is not None and hasattr(signal, 'SIGUSR2'):
+                self.loop.add_signal_handler(signal.SIGUSR2, self.dump_memory)
+            elif self.conn is None and hasattr(signal, 'SIGUSR2'):
+                # binary upgrade needs a master process
+                self.loop.add_signal_handler(signal.SIGUSR2, self._ignore_signal, signal.SIGUSR2)
+            if self.conn is None:
+                # handled by the master process, their default action would stop this one
+                for name in ('SIGHUP', 'SIGTTIN', 'SIGTTOU'):
+                    if hasattr(signal, name):
+                        sig = getattr(signal, name)
+                        self.loop.add_signal_handler(sig, self._ignore_signal, sig)
+        except NotImplementedError:  # pragma: no cover
+            # add_signal_handler is not implemented on Windows
+            pass
+
+    def _ignore_signal(self, sig: signal.Signals):
+        logger.warning(
+            f'Worker process [{os.getpid()}] ignores {sig.name}: '
+            f'there is no master process to handle it'
+        )
 
     def _setup_loop(self) -> asyncio.AbstractEventLoop:
         config = self.config
@@ -111,7 +559,7 @@ class Worker:
             except ImportError:  # pragma: no cover
                 pass
 
-        if config.workers > 1 and platform.system() == 'Windows':  # pragma: no cover
+        if config.use_supervisor and platform.system() == 'Windows':  # pragma: no cover
             warn_msg = (
                 'Using workers > 1 on Windows will force the use '
                 'of SelectorEventLoop due to some issues '
@@ -130,10 +578,23 @@ class Worker:
         loop = self.loop
         self._cancel_all_tasks()
         loop.run_until_complete(loop.shutdown_asyncgens())
-        try:
-            loop.run_until_complete(loop.shutdown_default_executor())
-        except AttributeError:  # pragma: no cover
-            pass  # shutdown_default_executor is new to Python 3.9
+        if self._memory_dump is not None and not self._memory_dump.done():
+            loop.run_until_complete(
+                asyncio.wait([self._memory_dump], timeout=self.config.executor_shutdown_timeout)
+            )
+        if self.executor is not None:
+            timeout = self.config.executor_shutdown_timeout
+            if not self.executor.shutdown_with_timeout(timeout):
+                logger.warning(
+                    f'Executor threads of worker process [{os.getpid()}] are still running '
+                    f'after executor_shutdown_timeout ({timeout}s), abandoning them'
+                )
+                self.executor_abandoned = True
+        else:
+            try:
+                loop.run_until_complete(loop.shutdown_default_executor())
+            except AttributeError:  # pragma: no cover
+                pass  # shutdown_default_executor is new to Python 3.9
         loop.close()
 
     def _cancel_all_tasks(self):
@@ -159,3 +620,18 @@ class Worker:
                         "task": task,
                     }
                 )
+
+
+def _get_body_size(response: Optional[web.StreamResponse]) -> int:
+    if response is None:
+        return 0
+    if response.prepared:
+        return response.body_length
+    length = response.content_length
+    if length is None and isinstance(response, web.Response):
+        body = response.body
+        if isinstance(body, (bytes, bytearray)):
+            length = len(body)
+        else:  # payload
+            length = getattr(body, 'size', None)
+    return length or 0
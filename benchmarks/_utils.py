@@ -0,0 +1,196 @@
+import asyncio
+import json
+import multiprocessing
+import socket
+import ssl
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Set, Dict, Optional, List, Tuple
+
+import aiohttp
+
+from aiohttp_serve import serve
+
+
+def _run(kwargs: dict):
+    serve(**kwargs)
+
+
+@contextmanager
+def start_server(**kwargs):
+    """
+    Runs serve(**kwargs) in a separate process
+    """
+    process = multiprocessing.get_context('spawn').Process(target=_run, args=(kwargs,))
+    process.start()
+    try:
+        yield process
+    finally:
+        process.terminate()
+        process.join()
+
+
+def wait_until_connectable(host: str, port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if host.startswith('unix:'):
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(1)
+                    sock.connect(host[len('unix:'):])
+            else:
+                socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _get_connector(unix_socket: Optional[str], **kwargs) -> aiohttp.BaseConnector:
+    if unix_socket is not None:
+        return aiohttp.UnixConnector(path=unix_socket, **kwargs)
+    # benchmarks use self-signed certificates
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    return aiohttp.TCPConnector(ssl=ssl_context, **kwargs)
+
+
+async def wait_for_workers(
+    url: str,
+    workers: int,
+    timeout: float = 60,
+    unix_socket: Optional[str] = None,
+) -> Set[int]:
+    """
+    Polls the pid endpoint on new connections until `workers` distinct pids answer
+    """
+    deadline = time.monotonic() + timeout
+    seen: Set[int] = set()
+    connector = _get_connector(unix_socket, force_close=True)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        while len(seen) < workers:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'Only {len(seen)} of {workers} workers answered {url}')
+            try:
+                async with session.get(url) as res:
+                    seen.add(int(await res.text()))
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.01)
+    return seen
+
+
+def read_memory(pid: int) -> Dict[str, int]:
+    """
+    Returns RSS and PSS (RSS with shared pages divided between processes) in bytes
+    """
+    result = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                result[name.lower()] = int(value.split()[0]) * 1024
+    return result
+
+
+def save_results(results, path: Optional[str]):
+    print(json.dumps(results, indent=2))
+    if path is not None:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+async def _load(
+    url: str,
+    concurrency: int,
+    duration: float,
+    unix_socket: Optional[str],
+    pid_header: bool,
+    new_connections: bool = False,
+) -> Tuple[List[float], int, Counter]:
+    latencies: List[float] = []
+    errors = 0
+    pids: Counter = Counter()
+
+    connector = _get_connector(unix_socket, limit=concurrency, force_close=new_connections)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        deadline = time.monotonic() + duration
+
+        async def client():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    async with session.get(url) as res:
+                        body = await res.read()
+                        if res.status != 200:
+                            errors += 1
+                            continue
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+                if pid_header:
+                    pids[int(body)] += 1
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    return latencies, errors, pids
+
+
+def _run_load(*args) -> Tuple[List[float], int, Counter]:
+    return asyncio.run(_load(*args))
+
+
+def run_load(
+    url: str,
+    *,
+    concurrency: int = 64,
+    duration: float = 10.0,
+    clients: int = 2,
+    unix_socket: Optional[str] = None,
+    count_pids: bool = False,
+    new_connections: bool = False,
+) -> dict:
+    """
+    Drives the server from `clients` processes with `concurrency` keep-alive
+    connections in total for `duration` seconds, with new_connections
+    every request is made on a new connection.
+    With count_pids the url must answer with the pid of the worker
+    """
+    per_client = max(1, concurrency // clients)
+    with ProcessPoolExecutor(clients, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [
+            pool.submit(
+                _run_load, url, per_client, duration, unix_socket, count_pids, new_connections
+            )
+            for _ in range(clients)
+        ]
+        results = [f.result() for f in futures]
+
+    latencies = sorted(lat for r in results for lat in r[0])
+    errors = sum(r[1] for r in results)
+    pids: Counter = sum((r[2] for r in results), Counter())
+
+    def percentile(p: float) -> Optional[float]:
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    result = dict(
+        requests=len(latencies),
+        errors=errors,
+        rps=round(len(latencies) / duration, 1),
+        latency_mean_ms=round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+        latency_p50_ms=percentile(0.5),
+        latency_p99_ms=percentile(0.99),
+        latency_p999_ms=percentile(0.999),
+    )
+    if count_pids:
+        result['requests_per_worker'] = sorted(pids.values(), reverse=True)
+    return result
@@ -0,0 +1,60 @@
+"""
+Throughput with access logging disabled, written synchronously
+from the event loop and written by a background thread (async_access_log=True)
+
+    python -m benchmarks.access_log --workers 2 --duration 10 --output access_log.json
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks._utils import start_server, run_load, save_results, wait_until_connectable
+
+
+def get_log_config(path: str) -> dict:
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'access': {'class': 'logging.FileHandler', 'filename': path},
+        },
+        'loggers': {
+            'aiohttp.access': {'handlers': ['access'], 'level': 'INFO', 'propagate': False},
+        },
+    }
+
+
+def bench(mode: str, args, log_dir: str) -> dict:
+    kwargs = dict(app='benchmarks.app:app', port=args.port, workers=args.workers)
+    if mode == 'off':
+        kwargs['access_log'] = None
+    else:
+        kwargs['log_config'] = get_log_config(os.path.join(log_dir, f'{mode}.log'))
+        kwargs['async_access_log'] = mode == 'async'
+
+    url = f'http://127.0.0.1:{args.port}/'
+    with start_server(**kwargs):
+        wait_until_connectable('127.0.0.1', args.port)
+        result = run_load(
+            url, concurrency=args.concurrency, duration=args.duration, clients=args.clients
+        )
+    return dict(mode=mode, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        results = [bench(mode, args, log_dir) for mode in ('off', 'sync', 'async')]
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
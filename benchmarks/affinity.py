@@ -0,0 +1,53 @@
+"""
+Latency of workers scheduled freely by the OS vs pinned to cpus
+with cpu_affinity='auto' (Linux only)
+
+    python -m benchmarks.affinity --workers 4 --duration 30 --output affinity.json
+
+Use fewer workers plus load generator clients than cpus,
+otherwise the load generator competes with pinned workers
+"""
+import argparse
+import asyncio
+
+from benchmarks._utils import start_server, run_load, save_results, wait_for_workers
+
+MODES = {
+    'os': dict(),
+    'pinned': dict(cpu_affinity='auto'),
+}
+
+
+def bench(mode: str, args) -> dict:
+    url = f'http://127.0.0.1:{args.port}/'
+    with start_server(
+        app='benchmarks.app:app',
+        port=args.port,
+        workers=args.workers,
+        reuse_port=True,
+        access_log=None,
+        **MODES[mode],
+    ):
+        asyncio.run(wait_for_workers(f'{url}pid', args.workers))
+        result = run_load(
+            url, concurrency=args.concurrency, duration=args.duration, clients=args.clients
+        )
+    return dict(mode=mode, workers=args.workers, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    results = [bench(mode, args) for mode in MODES]
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+import asyncio
+import os
+
+from aiohttp import web
+
+# read-only data loaded at import time, it is shared between forked workers
+# when the application is preloaded in the master process
+DATA_SIZE = int(os.environ.get('BENCH_DATA_SIZE', 0))
+DATA = tuple(bytes([i % 256]) * 1024 for i in range(DATA_SIZE // 1024))
+# served with web.static under /plain to compare with the static option of serve()
+STATIC_DIR = os.environ.get('BENCH_STATIC_DIR')
+
+
+async def index(request):
+    return web.Response(body=b'Hello world')
+
+
+async def pid(request):
+    return web.Response(text=str(os.getpid()))
+
+
+async def work(request):
+    # an IO bound handler, e.g. waiting for a database
+    await asyncio.sleep(float(request.query.get('delay', 0.01)))
+    return web.Response(body=b'Done')
+
+
+async def data(request):
+    return web.Response(body=b'x' * int(request.query.get('size', 1024 * 1024)))
+
+
+app = web.Application()
+app.router.add_get('/', index)
+app.router.add_get('/pid', pid)
+app.router.add_get('/work', work)
+app.router.add_get('/data', data)
+if STATIC_DIR:
+    app.router.add_static('/plain', STATIC_DIR)
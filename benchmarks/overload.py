@@ -0,0 +1,57 @@
+"""
+Latency under overload without a connection limit and with
+max_connections_per_worker in 'pause' and 'reject' modes
+
+    python -m benchmarks.overload --workers 2 --limit 64 --concurrency 1024 --output overload.json
+
+Every request is made on a new connection to a handler waiting --delay seconds.
+Rejected requests (503) are reported as errors
+"""
+import argparse
+
+from benchmarks._utils import start_server, run_load, save_results, wait_until_connectable
+
+
+def bench(mode: str, args) -> dict:
+    kwargs = dict(
+        app='benchmarks.app:app',
+        port=args.port,
+        workers=args.workers,
+        backlog=args.backlog,
+        access_log=None,
+    )
+    if mode != 'unlimited':
+        kwargs['max_connections_per_worker'] = args.limit
+        kwargs['overload_policy'] = mode
+
+    with start_server(**kwargs):
+        wait_until_connectable('127.0.0.1', args.port)
+        result = run_load(
+            f'http://127.0.0.1:{args.port}/work?delay={args.delay}',
+            concurrency=args.concurrency,
+            duration=args.duration,
+            clients=args.clients,
+            new_connections=True,
+        )
+    return dict(mode=mode, limit=args.limit if mode != 'unlimited' else None, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--limit', type=int, default=64)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--delay', type=float, default=0.05)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=1024)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    results = [bench(mode, args) for mode in ('unlimited', 'pause', 'reject')]
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Effect of bind URL socket options, each one is compared to the same load without options
+
+    python -m benchmarks.socket_options --workers 2 --duration 10 --output socket_options.json
+
+Short requests on new connections show backlog, defer_accept and fastopen,
+large responses on keep-alive connections show rcvbuf and sndbuf.
+fastopen only helps clients sending data in SYN, which the bundled
+load generator doesn't do, so it shows the overhead only
+"""
+import argparse
+
+from benchmarks._utils import start_server, run_load, save_results, wait_until_connectable
+
+# name, bind URL query, path, new connection per request
+CASES = (
+    ('baseline', '', '/', True),
+    ('backlog', 'backlog=4096', '/', True),
+    ('defer_accept', 'defer_accept=1', '/', True),
+    ('fastopen', 'fastopen=256', '/', True),
+    ('nodelay', 'nodelay=1', '/', True),
+    ('baseline_large', '', '/data?size=1048576', False),
+    ('buffers_large', 'rcvbuf=4194304&sndbuf=4194304', '/data?size=1048576', False),
+)
+
+
+def bench(name: str, query: str, path: str, new_connections: bool, args) -> dict:
+    bind = f'http://127.0.0.1:{args.port}'
+    if query:
+        bind = f'{bind}?{query}'
+
+    with start_server(app='benchmarks.app:app', bind=bind, workers=args.workers, access_log=None):
+        wait_until_connectable('127.0.0.1', args.port)
+        result = run_load(
+            f'http://127.0.0.1:{args.port}{path}',
+            concurrency=args.concurrency,
+            duration=args.duration,
+            clients=args.clients,
+            new_connections=new_connections,
+        )
+    return dict(case=name, options=query, path=path, new_connections=new_connections, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--cases', nargs='+', choices=[c[0] for c in CASES])
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    cases = [c for c in CASES if not args.cases or c[0] in args.cases]
+    results = [bench(*case, args) for case in cases]
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Cold start time and per-worker memory of spawned vs forked workers
+with preloaded application (Linux only)
+
+    python -m benchmarks.startup --workers 8 --output startup.json
+
+BENCH_DATA_SIZE environment variable sets the size of read-only data
+the benchmark application builds at import time (50MB by default)
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from benchmarks._utils import start_server, wait_for_workers, read_memory, save_results
+
+MODES = {
+    'spawn': dict(start_method='spawn'),
+    'fork+preload': dict(start_method='fork', preload_app=True),
+}
+
+
+def bench(mode: str, workers: int, port: int) -> dict:
+    url = f'http://127.0.0.1:{port}/pid'
+    started = time.monotonic()
+    with start_server(
+        app='benchmarks.app:app',
+        port=port,
+        workers=workers,
+        reuse_port=True,
+        **MODES[mode],
+    ):
+        pids = asyncio.run(wait_for_workers(url, workers))
+        ready_time = time.monotonic() - started
+        memory = [read_memory(pid) for pid in pids]
+
+    return dict(
+        mode=mode,
+        workers=workers,
+        ready_time=round(ready_time, 3),
+        worker_rss_mean=int(statistics.mean(m['rss'] for m in memory)),
+        worker_pss_mean=int(statistics.mean(m['pss'] for m in memory)),
+    )
+
+
+def main():
+    os.environ.setdefault('BENCH_DATA_SIZE', str(50 * 1024 * 1024))
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    results = [bench(mode, args.workers, args.port) for mode in MODES]
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
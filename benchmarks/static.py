@@ -0,0 +1,61 @@
+"""
+Static files served by the static option of serve() (cached open files, sendfile)
+compared to a web.static route of the application, for several file sizes
+
+    python -m benchmarks.static --workers 2 --duration 10 --output static.json
+"""
+import argparse
+import os
+import tempfile
+
+from benchmarks._utils import start_server, run_load, save_results, wait_until_connectable
+
+SIZES = (1024, 64 * 1024, 1024 * 1024)
+
+
+def bench(mode: str, directory: str, size: int, args) -> dict:
+    kwargs = dict(app='benchmarks.app:app', port=args.port, workers=args.workers, access_log=None)
+    if mode == 'serve_static':
+        kwargs['static'] = {'/static': directory}
+        path = f'/static/file_{size}.bin'
+    else:
+        path = f'/plain/file_{size}.bin'
+
+    with start_server(**kwargs):
+        wait_until_connectable('127.0.0.1', args.port)
+        result = run_load(
+            f'http://127.0.0.1:{args.port}{path}',
+            concurrency=args.concurrency,
+            duration=args.duration,
+            clients=args.clients,
+        )
+    return dict(mode=mode, size=size, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            with open(os.path.join(directory, f'file_{size}.bin'), 'wb') as f:
+                f.write(os.urandom(size))
+        # read by the application of spawned workers
+        os.environ['BENCH_STATIC_DIR'] = directory
+
+        for size in args.sizes:
+            for mode in ('web_static', 'serve_static'):
+                results.append(bench(mode, directory, size, args))
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
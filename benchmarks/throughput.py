@@ -0,0 +1,127 @@
+"""
+Throughput, latency and distribution of requests between workers
+for every combination of worker count, event loop, bind type and scheme
+
+    python -m benchmarks.throughput --workers 1 2 4 --duration 10 --output throughput.json
+
+Unix sockets are served without TLS, so unix runs are http only.
+https binds use a self-signed certificate generated with trustme
+unless --certfile and --keyfile are given. uvloop runs are skipped
+when uvloop is not installed
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+import tempfile
+from benchmarks._utils import (
+    start_server,
+    run_load,
+    save_results,
+    wait_until_connectable,
+    wait_for_workers,
+)
+
+
+def get_loops(requested):
+    loops = []
+    for loop in requested:
+        if loop == 'uvloop':
+            try:
+                import uvloop  # noqa
+            except ImportError:
+                print('uvloop is not installed, skipping uvloop runs')
+                continue
+        loops.append(loop)
+    return loops
+
+
+@contextlib.contextmanager
+def get_certificate(args):
+    if args.certfile is not None:
+        yield args.certfile, args.keyfile
+        return
+
+    import trustme
+
+    cert = trustme.CA().issue_cert('localhost', '127.0.0.1')
+    with cert.cert_chain_pems[0].tempfile() as certfile:
+        with cert.private_key_pem.tempfile() as keyfile:
+            yield certfile, keyfile
+
+
+def bench(
+    args,
+    workers: int,
+    loop: str,
+    bind_type: str,
+    scheme: str,
+    certificate,
+    socket_dir: str,
+) -> dict:
+    kwargs = dict(
+        app='benchmarks.app:app',
+        workers=workers,
+        use_uvloop=loop == 'uvloop',
+        access_log=None,
+    )
+
+    unix_socket = None
+    if bind_type == 'unix':
+        unix_socket = os.path.join(socket_dir, 'bench.sock')
+        kwargs['bind'] = f'unix:{unix_socket}'
+        host, port = f'unix:{unix_socket}', None
+        base_url = f'{scheme}://localhost'
+    else:
+        kwargs['bind'] = f'{scheme}://127.0.0.1:{args.port}'
+        host, port = '127.0.0.1', args.port
+        base_url = f'{scheme}://127.0.0.1:{args.port}'
+
+    if scheme == 'https':
+        kwargs['ssl_certfile'], kwargs['ssl_keyfile'] = certificate
+
+    with start_server(**kwargs):
+        wait_until_connectable(host, port)
+        asyncio.run(wait_for_workers(f'{base_url}/pid', workers, unix_socket=unix_socket))
+        result = run_load(
+            f'{base_url}/pid',
+            concurrency=args.concurrency,
+            duration=args.duration,
+            clients=args.clients,
+            unix_socket=unix_socket,
+            count_pids=True,
+        )
+
+    return dict(workers=workers, loop=loop, bind=bind_type, scheme=scheme, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--loops', nargs='+', default=['asyncio', 'uvloop'])
+    parser.add_argument('--binds', nargs='+', default=['tcp', 'unix'])
+    parser.add_argument('--schemes', nargs='+', default=['http', 'https'])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    matrix = itertools.product(args.workers, get_loops(args.loops), args.binds, args.schemes)
+    with get_certificate(args) as certificate, tempfile.TemporaryDirectory() as socket_dir:
+        for workers, loop, bind_type, scheme in matrix:
+            if bind_type == 'unix' and scheme == 'https':
+                continue  # unix sockets are served without TLS
+            result = bench(args, workers, loop, bind_type, scheme, certificate, socket_dir)
+            print(result)
+            results.append(result)
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
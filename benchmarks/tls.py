@@ -0,0 +1,106 @@
+"""
+Rate of full and resumed TLS handshakes against spawned workers
+(session ticket keys per worker) and forked workers (ticket keys shared via the master)
+
+    python -m benchmarks.tls --workers 4 --duration 10 --output tls.json
+"""
+import argparse
+import multiprocessing
+import socket
+import ssl
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Tuple
+
+from benchmarks._utils import start_server, save_results, wait_until_connectable
+from benchmarks.throughput import get_certificate
+
+MODES = {
+    'spawn': dict(start_method='spawn'),
+    'fork': dict(start_method='fork'),
+}
+
+
+def connect(port: int, context: ssl.SSLContext, session=None) -> ssl.SSLSocket:
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock = context.wrap_socket(sock, server_hostname='127.0.0.1', session=session)
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+    while sock.recv(65536):
+        pass
+    return sock
+
+
+def handshakes(port: int, duration: float, resume: bool) -> Tuple[int, int]:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    session = None
+    if resume:
+        with connect(port, context) as sock:
+            session = sock.session
+
+    count = reused = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        with connect(port, context, session) as sock:
+            count += 1
+            reused += sock.session_reused
+    return count, reused
+
+
+def bench(mode: str, resume: bool, args, certificate) -> dict:
+    certfile, keyfile = certificate
+    with start_server(
+        app='benchmarks.app:app',
+        bind=f'https://127.0.0.1:{args.port}',
+        workers=args.workers,
+        reuse_port=True,
+        access_log=None,
+        ssl_certfile=certfile,
+        ssl_keyfile=keyfile,
+        **MODES[mode],
+    ):
+        wait_until_connectable('127.0.0.1', args.port)
+        time.sleep(1)  # let all workers start
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(args.clients, mp_context=context) as pool:
+            futures = [
+                pool.submit(handshakes, args.port, args.duration, resume)
+                for _ in range(args.clients)
+            ]
+            results = [f.result() for f in futures]
+
+    count = sum(r[0] for r in results)
+    reused = sum(r[1] for r in results)
+    return dict(
+        mode=mode,
+        resume=resume,
+        workers=args.workers,
+        handshakes=count,
+        handshakes_per_second=round(count / args.duration, 1),
+        reused_ratio=round(reused / count, 3) if count else None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    parser.add_argument('--output', help='save results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with get_certificate(args) as certificate:
+        for mode in MODES:
+            for resume in (False, True):
+                results.append(bench(mode, resume, args, certificate))
+    save_results(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
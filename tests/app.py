@@ -1,4 +1,7 @@
 import asyncio
+import os
+import threading
+import time
 
 from aiohttp import web
 
@@ -7,13 +10,56 @@ async def index(request):
     return web.Response(body='Index')
 
 
+async def pid(request):
+    return web.Response(text=str(os.getpid()))
+
+
+async def sleep(request):
+    await asyncio.sleep(float(request.query.get('delay', 1)))
+    return web.Response(text='Done')
+
+
+async def block(request):
+    time.sleep(float(request.query.get('delay', 1)))
+    return web.Response(text='Done')
+
+
+async def executor(request):
+    def work():
+        time.sleep(float(request.query.get('delay', 0.1)))
+        return threading.current_thread().name
+
+    name = await asyncio.get_event_loop().run_in_executor(None, work)
+    return web.Response(text=name)
+
+
+async def cached(request):
+    response = web.Response(text=str(os.getpid()))
+    response.headers['Cache-Control'] = request.query.get('cache_control', 'max-age=60')
+    return response
+
+
+async def user(request):
+    response = web.Response(text=f'user={request.cookies.get("user", "")}')
+    if 'cache_control' in request.query:
+        response.headers['Cache-Control'] = request.query['cache_control']
+    return response
+
+
 app = web.Application()
 app.router.add_get('/', index)
+app.router.add_get('/pid', pid)
+app.router.add_get('/sleep', sleep)
+app.router.add_get('/block', block)
+app.router.add_get('/executor', executor)
+app.router.add_get('/cached', cached)
+app.router.add_get('/user', user)
 
 
 def app_factory():
     result = web.Application()
     result.router.add_get('/', index)
+    result.router.add_get('/pid', pid)
     return result
 
 
@@ -21,4 +67,5 @@ async def async_app_factory():
     await asyncio.sleep(0.1)
     result = web.Application()
     result.router.add_get('/', index)
+    result.router.add_get('/pid', pid)
     return result
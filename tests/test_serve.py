@@ -1,7 +1,37 @@
+import asyncio
+import gzip
+import os
+import signal
+import socket
+import ssl
+import subprocess
+import sys
+import time
+from collections import Counter
+
+import aiohttp
 import pytest
+import trustme
 from yarl import URL
 
-from tests.utils import Config, start_server, fetch
+from aiohttp_serve import _utils
+from aiohttp_serve._config import BindInfo, Config as ServeConfig
+from aiohttp_serve._control import send_command, ControlError
+from aiohttp_serve._socket import bind_socket
+from aiohttp_serve._utils import get_cpu_sets
+from tests.utils import (
+    Config,
+    start_server,
+    start_server_with_socket,
+    fetch,
+    fetch_pids,
+    fetch_text,
+    wait_for_workers,
+    wait_for_children,
+    tls_get,
+    is_connectable,
+    wait_until_connectable,
+)
 
 DEFAULT_HOST = '127.0.0.1'
 DEFAULT_PORT = 8080
@@ -9,6 +39,8 @@ DEFAULT_HTTP_URL = f'http://{DEFAULT_HOST}:{DEFAULT_PORT}/'
 DEFAULT_HTTPS_URL = f'https://{DEFAULT_HOST}:{DEFAULT_PORT}/'
 
 DEFAULT_APP = 'tests.app:app'
+DEFAULT_PID_URL = f'{DEFAULT_HTTP_URL}pid'
+DEFAULT_HTTPS_PID_URL = f'{DEFAULT_HTTPS_URL}pid'
 
 
 @pytest.mark.asyncio
@@ -135,3 +167,872 @@ async def test_bind_multiple_hosts(ssl_certfile, ssl_keyfile, client_ssl_context
 
             res = await fetch(url=url, ssl_context=ssl_context, uds=uds)
             assert res.status == 200
+
+
+@pytest.mark.asyncio
+async def test_adaptive_keepalive():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        max_connections_per_worker=10,
+        adaptive_keepalive=True,
+        keepalive_pressure_threshold=0.5,
+    )
+    with start_server(config):
+        connections = []
+        try:
+            for _ in range(8):
+                sock = socket.create_connection((DEFAULT_HOST, DEFAULT_PORT))
+                sock.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\n\r\n')
+                assert sock.recv(1024).endswith(b'Index')
+                connections.append(sock)
+                await asyncio.sleep(0.05)
+
+            # 8 of 10 connections is over the threshold, the oldest idle ones
+            # are closed down to 5
+            for sock in connections[:3]:
+                sock.settimeout(5)
+                assert sock.recv(1024) == b''
+            for sock in connections[3:]:
+                sock.settimeout(0.1)
+                with pytest.raises(socket.timeout):
+                    sock.recv(1024)
+        finally:
+            for sock in connections:
+                sock.close()
+
+
+@pytest.mark.asyncio
+async def test_bind_options():
+    url = 'http://127.0.0.1:8080?backlog=1024&nodelay=1&defer_accept=1&fastopen=16&rcvbuf=65536'
+    config = Config(DEFAULT_APP, bind=url, workers=2)
+    with start_server(config):
+        res = await fetch(url=DEFAULT_HTTP_URL)
+        assert res.status == 200
+
+    sock = bind_socket(BindInfo(url))
+    try:
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY)
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_DEFER_ACCEPT) > 0
+        assert sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_FASTOPEN) == 16
+        # the kernel doubles the value for bookkeeping overhead
+        assert sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 65536
+    finally:
+        sock.close()
+
+
+@pytest.mark.parametrize(
+    'url',
+    [
+        'http://127.0.0.1:8080?unknown=1',
+        'http://127.0.0.1:8080?backlog=many',
+        'unix:/tmp/aiohttp-serve.sock?nodelay=1',
+    ],
+)
+def test_bind_options_invalid(url):
+    with pytest.raises(ValueError):
+        BindInfo(url)
+
+
+@pytest.mark.parametrize(
+    'kwargs',
+    [
+        dict(metrics_bind='unix:///tmp/metrics.sock'),
+        dict(metrics_bind='https://127.0.0.1:9100'),
+        dict(metrics_bind='http://127.0.0.1:9100/metrics'),
+        dict(slow_callback_threshold=0),
+        dict(slow_callback_threshold=-1),
+    ],
+)
+def test_config_invalid(kwargs):
+    with pytest.raises(ValueError):
+        ServeConfig(**kwargs)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    'bind, env',
+    [
+        ('fd://3', None),
+        ('systemd:web', dict(LISTEN_FDS='1', LISTEN_FDNAMES='web')),
+    ],
+)
+async def test_bind_inherited_socket(tmp_path, bind, env):
+    path = str(tmp_path / 'inherited.sock')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(128)
+    try:
+        for _ in range(2):
+            # connections made while the server is down wait in the backlog
+            pending = asyncio.ensure_future(fetch(url='http://localhost/', uds=path))
+            await asyncio.sleep(0.1)
+            with start_server_with_socket(sock, bind, env):
+                res = await asyncio.wait_for(pending, 10)
+                assert res.status == 200
+            # the socket is not removed on shutdown
+            assert os.path.exists(path)
+    finally:
+        sock.close()
+
+
+@pytest.mark.asyncio
+async def test_reuse_port_distribution():
+    workers = 4
+    requests = 200
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=workers,
+        reuse_port=True,
+    )
+    with start_server(config):
+        await wait_for_workers(DEFAULT_PID_URL, workers)
+        spread = Counter(await fetch_pids(DEFAULT_PID_URL, requests))
+        assert len(spread) == workers
+        # kernel hashing is not perfectly even, but no worker should starve
+        assert min(spread.values()) >= requests / workers / 4
+
+
+@pytest.mark.asyncio
+async def test_max_connections_reject():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        max_connections_per_worker=2,
+        overload_policy='reject',
+    )
+    with start_server(config):
+        busy = [
+            asyncio.ensure_future(fetch(url=f'{DEFAULT_HTTP_URL}sleep?delay=2')) for _ in range(2)
+        ]
+        await asyncio.sleep(0.5)
+        res = await fetch(url=DEFAULT_HTTP_URL)
+        assert res.status == 503
+        assert [r.status for r in await asyncio.gather(*busy)] == [200, 200]
+
+        res = await fetch(url=DEFAULT_HTTP_URL)
+        assert res.status == 200
+
+
+@pytest.mark.asyncio
+async def test_max_connections_pause():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        max_connections_per_worker=1,
+    )
+    with start_server(config):
+        busy = asyncio.ensure_future(fetch(url=f'{DEFAULT_HTTP_URL}sleep?delay=1'))
+        await asyncio.sleep(0.3)
+        # waits in the backlog until the busy connection is closed
+        started = time.monotonic()
+        res = await fetch(url=DEFAULT_HTTP_URL)
+        assert res.status == 200
+        assert (await busy).status == 200
+        assert time.monotonic() - started > 0.5
+
+
+@pytest.mark.asyncio
+async def test_dead_worker_respawn():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        reuse_port=True,
+    )
+    with start_server(config):
+        pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        killed = pids.pop()
+        os.kill(killed, signal.SIGKILL)
+        await asyncio.sleep(0.5)
+
+        new_pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        assert killed not in new_pids
+        assert pids < new_pids
+
+
+@pytest.mark.asyncio
+async def test_master_signals_without_master():
+    config = Config(DEFAULT_APP, host=DEFAULT_HOST, port=DEFAULT_PORT)
+    with start_server(config) as process:
+        for sig in (signal.SIGHUP, signal.SIGUSR2, signal.SIGTTIN, signal.SIGTTOU):
+            os.kill(process.pid, sig)
+            await asyncio.sleep(0.2)
+            assert await fetch_pids(DEFAULT_PID_URL, 1) == [process.pid]
+
+
+@pytest.mark.asyncio
+async def test_max_requests():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        max_requests=5,
+    )
+    with start_server(config):
+        seen = set()
+        for _ in range(10):
+            seen.update(await fetch_pids(DEFAULT_PID_URL, 5))
+        assert len(seen) > 2
+
+
+@pytest.mark.asyncio
+async def test_max_requests_single_worker():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        max_requests=3,
+    )
+    with start_server(config) as process:
+        # the recycled worker is replaced instead of ending the server
+        seen = set()
+        for _ in range(4):
+            seen.update(await fetch_pids(DEFAULT_PID_URL, 3))
+        assert len(seen) > 1
+        assert process.pid not in seen
+        assert process.is_alive()
+
+
+@pytest.mark.asyncio
+async def test_scale_signals():
+    config = Config(DEFAULT_APP, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=2)
+    with start_server(config) as process:
+        await wait_for_children(process.pid, 2)
+
+        os.kill(process.pid, signal.SIGTTIN)
+        await wait_for_children(process.pid, 3)
+        assert len(await wait_for_workers(DEFAULT_PID_URL, 3)) == 3
+
+        # the same signal delivered twice before the handler runs is handled once
+        os.kill(process.pid, signal.SIGTTOU)
+        await wait_for_children(process.pid, 2)
+        os.kill(process.pid, signal.SIGTTOU)
+        pids = await wait_for_children(process.pid, 1)
+        assert set(await fetch_pids(DEFAULT_PID_URL, 5)) == pids
+
+
+@pytest.mark.asyncio
+async def test_control_socket(tmp_path):
+    path = str(tmp_path / 'control.sock')
+    config = Config(
+        DEFAULT_APP, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=2, control_socket=path
+    )
+    with start_server(config) as process:
+        await wait_for_children(process.pid, 2)
+        await fetch_pids(DEFAULT_PID_URL, 10)
+
+        stats = send_command(path, 'stats')
+        assert stats['pid'] == process.pid
+        assert len(stats['workers']) == 2
+        assert sum(w['requests_total'] for w in stats['workers']) >= 10
+        for worker in stats['workers']:
+            assert worker['rss'] > 0
+            assert {'uptime', 'connections', 'request_rate', 'loop_lag'} <= set(worker)
+
+        old_pid = send_command(path, 'workers')[0]['pid']
+        result = send_command(path, f'drain {old_pid}')
+        assert result['pid'] == old_pid
+        pids = await wait_for_children(process.pid, 2)
+        assert old_pid not in pids and result['replacement'] in pids
+
+        assert send_command(path, 'scale 3') == {'workers': 3}
+        await wait_for_children(process.pid, 3)
+
+        with pytest.raises(ControlError):
+            send_command(path, 'drain 1')
+        with pytest.raises(ControlError):
+            send_command(path, 'unknown')
+
+    assert not os.path.exists(path)
+
+
+@pytest.mark.asyncio
+async def test_worker_timeout():
+    config = Config(DEFAULT_APP, host=DEFAULT_HOST, port=DEFAULT_PORT, worker_timeout=1)
+    with start_server(config) as process:
+        (pid,) = await wait_for_children(process.pid, 1)
+        await fetch_pids(DEFAULT_PID_URL, 1)
+
+        # blocks the event loop far longer than worker_timeout
+        with socket.create_connection((DEFAULT_HOST, DEFAULT_PORT)) as sock:
+            sock.settimeout(10)
+            sock.sendall(b'GET /block?delay=60 HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            # the connection is closed by the kill, no response
+            assert sock.recv(1024) == b''
+
+        (new_pid,) = await wait_for_children(process.pid, 1)
+        assert new_pid != pid
+        assert await wait_for_workers(DEFAULT_PID_URL, 1) == {new_pid}
+
+
+@pytest.mark.asyncio
+async def test_memory_profiling(tmp_path):
+    path = str(tmp_path / 'control.sock')
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        control_socket=path,
+        memory_profiling=True,
+        memory_profiling_interval=0.2,
+        memory_profiling_dir=str(tmp_path),
+    )
+    with start_server(config) as process:
+        (pid,) = await wait_for_children(process.pid, 1)
+        await fetch_pids(DEFAULT_PID_URL, 10)
+        await asyncio.sleep(0.5)
+
+        (report,) = send_command(path, 'memory')
+        assert report['pid'] == pid
+        assert report['traced'] > 0
+        assert report['history']
+        assert report['since_start'] and 'site' in report['since_start'][0]
+
+        os.kill(pid, signal.SIGUSR2)
+        for _ in range(50):
+            dumps = list(tmp_path.glob(f'aiohttp-serve-memory-{pid}-*.txt'))
+            if dumps:
+                break
+            await asyncio.sleep(0.1)
+        assert 'top allocation sites since start' in dumps[0].read_text()
+
+
+@pytest.mark.asyncio
+async def test_autoscale():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=1,
+        min_workers=1,
+        max_workers=3,
+        autoscale_metric='connections',
+        autoscale_up_threshold=1,
+        autoscale_down_threshold=0.5,
+        autoscale_interval=0.3,
+        autoscale_cooldown=0.5,
+    )
+    with start_server(config) as process:
+        await wait_for_children(process.pid, 1)
+
+        # idle connections load the only worker
+        connections = [socket.create_connection((DEFAULT_HOST, DEFAULT_PORT)) for _ in range(6)]
+        try:
+            await wait_for_children(process.pid, 3)
+        finally:
+            for sock in connections:
+                sock.close()
+
+        await wait_for_children(process.pid, 1)
+
+
+@pytest.mark.asyncio
+async def test_rolling_reload():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+    )
+    with start_server(config) as server:
+        old_pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        os.kill(server.pid, signal.SIGHUP)
+
+        # every request must succeed while workers are being replaced
+        for _ in range(100):
+            pids = set(await fetch_pids(DEFAULT_PID_URL, 10))
+            if not pids & old_pids:
+                break
+            await asyncio.sleep(0.1)
+
+        new_pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        assert not new_pids & old_pids
+
+
+UPGRADE_SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+from aiohttp_serve import serve
+
+if __name__ == '__main__':
+    serve('tests.app:app', bind=sys.argv[1:], workers=2)
+"""
+
+
+@pytest.mark.asyncio
+async def test_binary_upgrade(tmp_path):
+    script = tmp_path / 'run.py'
+    script.write_text(UPGRADE_SCRIPT.format(root=os.getcwd()))
+    unix_path = str(tmp_path / 'app.sock')
+    old_master = subprocess.Popen(
+        [sys.executable, str(script), DEFAULT_HTTP_URL.rstrip('/'), f'unix:{unix_path}']
+    )
+    new_master_pid = None
+    try:
+        wait_until_connectable(DEFAULT_HTTP_URL)
+        old_pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+
+        failures = []
+        done = asyncio.Event()
+
+        async def load():
+            while not done.is_set():
+                try:
+                    res = await fetch(url=DEFAULT_HTTP_URL)
+                    assert res.status == 200
+                except Exception as e:
+                    failures.append(e)
+
+        load_task = asyncio.ensure_future(load())
+        os.kill(old_master.pid, signal.SIGUSR2)
+        # the old master exits as soon as the new one is ready and its workers are drained
+        await asyncio.get_event_loop().run_in_executor(None, old_master.wait, 30)
+        done.set()
+        await load_task
+        assert failures == []
+
+        new_pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        assert not new_pids & old_pids
+        with open(f'/proc/{next(iter(new_pids))}/stat') as f:
+            new_master_pid = int(f.read().rsplit(')', 1)[1].split()[1])
+        assert new_master_pid != old_master.pid
+
+        # the unix socket was handed over, not removed
+        res = await fetch(url='http://localhost/', uds=unix_path)
+        assert res.status == 200
+    finally:
+        if old_master.poll() is None:
+            old_master.kill()
+        if new_master_pid is not None:
+            os.kill(new_master_pid, signal.SIGTERM)
+            while os.path.exists(f'/proc/{new_master_pid}'):
+                await asyncio.sleep(0.1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('workers', [1, 2])
+async def test_graceful_shutdown(workers):
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=workers,
+        shutdown_timeout=5,
+    )
+    with start_server(config) as server:
+        request = asyncio.ensure_future(fetch(url=f'{DEFAULT_HTTP_URL}sleep?delay=1'))
+        await asyncio.sleep(0.3)
+        server.terminate()
+
+        res = await request
+        assert res.status == 200
+        await asyncio.get_running_loop().run_in_executor(None, server.join)
+        assert not is_connectable(DEFAULT_HTTP_URL)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('app', [DEFAULT_APP, 'tests.app:async_app_factory()'])
+async def test_preload_app_fork(app):
+    config = Config(
+        app,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        start_method='fork',
+        preload_app=True,
+    )
+    with start_server(config) as server:
+        res = await fetch(url=DEFAULT_HTTP_URL)
+        assert res.status == 200
+
+        # respawned worker is forked from the master as well
+        pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        killed = pids.pop()
+        os.kill(killed, signal.SIGKILL)
+        await asyncio.sleep(0.5)
+        new_pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        assert killed not in new_pids
+        assert server.pid not in new_pids
+
+
+def test_ssl_session_resumption_across_workers(ssl_certfile, ssl_keyfile, client_ssl_context):
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        start_method='fork',
+        reuse_port=True,
+        ssl_certfile=ssl_certfile,
+        ssl_keyfile=ssl_keyfile,
+    )
+    client_ssl_context.set_alpn_protocols(['h2', 'http/1.1'])
+    with start_server(config):
+        wait_until_connectable(DEFAULT_HTTPS_URL)
+        first = tls_get(DEFAULT_HOST, DEFAULT_PORT, '/pid', client_ssl_context)
+        assert first.alpn_protocol == 'http/1.1'
+
+        pids = set()
+        for _ in range(30):
+            res = tls_get(DEFAULT_HOST, DEFAULT_PORT, '/pid', client_ssl_context, first.session)
+            # tickets issued by one worker are accepted by the others
+            assert res.session_reused
+            pids.add(int(res.body))
+        assert len(pids) == 2
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('trigger, workers', [('signal', 2), ('watch', 2), ('signal', 1)])
+async def test_ssl_certificate_reload(tmp_path, ssl_cert, client_ssl_context, trigger, workers):
+    certfile, keyfile = tmp_path / 'cert.pem', tmp_path / 'key.pem'
+    ssl_cert.cert_chain_pems[0].write_to_path(str(certfile))
+    ssl_cert.private_key_pem.write_to_path(str(keyfile))
+
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=workers,
+        ssl_certfile=str(certfile),
+        ssl_keyfile=str(keyfile),
+        ssl_watch_interval=0.1 if trigger == 'watch' else None,
+    )
+    new_ca = trustme.CA()
+    new_client_ssl_context = ssl.create_default_context()
+    new_ca.configure_trust(new_client_ssl_context)
+
+    with start_server(config) as process:
+        await wait_for_workers(DEFAULT_HTTPS_PID_URL, workers, client_ssl_context)
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(DEFAULT_HTTPS_URL, ssl=client_ssl_context) as res:
+                assert res.status == 200
+
+            new_cert = new_ca.issue_cert('127.0.0.1')
+            new_cert.private_key_pem.write_to_path(str(keyfile))
+            new_cert.cert_chain_pems[0].write_to_path(str(certfile))
+            if trigger == 'signal':
+                os.kill(process.pid, signal.SIGUSR1)
+            await asyncio.sleep(0.5)
+
+            # the established connection keeps working with the old certificate
+            async with session.get(DEFAULT_HTTPS_URL, ssl=client_ssl_context) as res:
+                assert res.status == 200
+
+        pids = await wait_for_workers(DEFAULT_HTTPS_PID_URL, workers, new_client_ssl_context)
+        assert len(pids) == workers
+
+
+@pytest.mark.asyncio
+async def test_cpu_affinity():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        cpu_affinity=[0],
+    )
+    with start_server(config):
+        wait_until_connectable(DEFAULT_HTTP_URL)
+        pids = await wait_for_workers(DEFAULT_PID_URL, 2)
+        for pid in pids:
+            assert os.sched_getaffinity(pid) == {0}
+
+
+def test_cpu_affinity_auto_spreads_numa_nodes(monkeypatch):
+    monkeypatch.setattr(_utils, 'get_numa_nodes', lambda: [{0, 1, 2}, {3, 4, 5}])
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1, 3, 4, 5})
+    assert get_cpu_sets('auto') == [{0}, {3}, {1}, {4}, {5}]
+    assert get_cpu_sets([0, [1, 2]]) == [{0}, {1, 2}]
+
+
+@pytest.mark.asyncio
+async def test_static(tmp_path):
+    (tmp_path / 'app.js').write_text('console.log(1)')
+    (tmp_path / 'app.js.gz').write_bytes(gzip.compress(b'console.log(1)'))
+    (tmp_path / 'style.css').write_text('body {}')
+    (tmp_path / '.secret').write_text('secret')
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        static={'/static': str(tmp_path)},
+        static_cache_ttl=0.1,
+    )
+    url = f'{DEFAULT_HTTP_URL}static'
+    with start_server(config):
+        async with aiohttp.ClientSession(auto_decompress=False) as session:
+            async with session.get(f'{url}/style.css') as res:
+                assert res.status == 200
+                assert res.content_type == 'text/css'
+                assert await res.text() == 'body {}'
+                etag = res.headers['ETag']
+
+            async with session.get(f'{url}/style.css', headers={'If-None-Match': etag}) as res:
+                assert res.status == 304
+
+            headers = {'Accept-Encoding': 'gzip, deflate'}
+            async with session.get(f'{url}/app.js', headers=headers) as res:
+                assert res.headers['Content-Encoding'] == 'gzip'
+                assert gzip.decompress(await res.read()) == b'console.log(1)'
+
+            for accept_encoding in ('', 'gzip;q=0, deflate', '*, gzip;q=0'):
+                headers = {'Accept-Encoding': accept_encoding}
+                async with session.get(f'{url}/app.js', headers=headers) as res:
+                    assert 'Content-Encoding' not in res.headers
+                    assert await res.text() == 'console.log(1)'
+
+            # the cached file is reopened once it changes
+            (tmp_path / 'style.css').write_text('body { color: red }')
+            await asyncio.sleep(0.2)
+            async with session.get(f'{url}/style.css') as res:
+                assert await res.text() == 'body { color: red }'
+
+            for path in ('.secret', '../app.js', 'missing.css', 'a%00b', ''):
+                async with session.get(f'{url}/{path}') as res:
+                    assert res.status == 404
+
+
+@pytest.mark.asyncio
+async def test_response_cache():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        response_cache_size=1024 * 1024,
+    )
+    with start_server(config) as process:
+        await wait_for_children(process.pid, 2)
+        connector = aiohttp.TCPConnector(force_close=True)
+        async with aiohttp.ClientSession(connector=connector) as session:
+
+            async def get_pids(url: str, count: int, **kwargs):
+                result = []
+                for _ in range(count):
+                    async with session.get(url, **kwargs) as res:
+                        result.append(int(await res.text()))
+                return result
+
+            # not cached, so both workers answer sooner or later
+            private_url = f'{DEFAULT_HTTP_URL}cached?cache_control=private'
+            pids = set()
+            while len(pids) < 2:
+                pids.update(await get_pids(private_url, 10))
+
+            # the response cached by one worker is served by both
+            assert len(set(await get_pids(f'{DEFAULT_HTTP_URL}cached', 20))) == 1
+            async with session.get(f'{DEFAULT_HTTP_URL}cached') as res:
+                assert 'Age' in res.headers
+                assert res.headers['Cache-Control'] == 'max-age=60'
+
+            headers = {'Cache-Control': 'no-cache'}
+            async with session.get(f'{DEFAULT_HTTP_URL}cached', headers=headers) as res:
+                assert 'Age' not in res.headers
+
+            # per user responses are never served to someone else
+            for query in ('', '?cache_control=max-age=60'):
+                for name in ('alice', 'bob', '', 'alice'):
+                    headers = {'Cookie': f'user={name}'} if name else {}
+                    url = f'{DEFAULT_HTTP_URL}user{query}'
+                    async with session.get(url, headers=headers) as res:
+                        assert await res.text() == f'user={name}'
+
+            # responses without an explicit opt-in are not cached
+            for _ in range(2):
+                async with session.get(f'{DEFAULT_HTTP_URL}user') as res:
+                    assert 'Age' not in res.headers
+
+
+@pytest.mark.asyncio
+async def test_metrics():
+    metrics_url = 'http://127.0.0.1:9100/metrics'
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        metrics_bind='http://127.0.0.1:9100',
+    )
+    with start_server(config):
+        wait_until_connectable(metrics_url)
+        for _ in range(10):
+            await fetch(url=DEFAULT_HTTP_URL)
+        await fetch(url=f'{DEFAULT_HTTP_URL}not-found')
+
+        samples = {}
+        for line in (await fetch_text(metrics_url)).splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+
+        def total(name):
+            return sum(v for k, v in samples.items() if k.startswith(name + '{'))
+
+        assert total('aiohttp_serve_requests_total') == 11
+        assert total('aiohttp_serve_responses_2xx_total') == 10
+        assert total('aiohttp_serve_responses_4xx_total') == 1
+        assert total('aiohttp_serve_sent_bytes_total') > 0
+        assert total('aiohttp_serve_request_duration_seconds_count') == 11
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor():
+    metrics_url = 'http://127.0.0.1:9100/metrics'
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=1,
+        metrics_bind='http://127.0.0.1:9100',
+        loop_monitor=True,
+        slow_callback_threshold=0.1,
+    )
+    with start_server(config):
+        wait_until_connectable(metrics_url)
+        await fetch(url=f'{DEFAULT_HTTP_URL}block?delay=0.5')
+        # wait for the worker to publish its metrics
+        await asyncio.sleep(1.5)
+
+        metrics = await fetch_text(metrics_url)
+        assert 'aiohttp_serve_slow_callbacks_total{worker="0"} 1.0' in metrics
+        assert 'aiohttp_serve_loop_lag_p99_seconds{worker="0"} 0.0' not in metrics
+
+
+@pytest.mark.asyncio
+async def test_executor_threads():
+    metrics_url = 'http://127.0.0.1:9100/metrics'
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        metrics_bind='http://127.0.0.1:9100',
+        executor_threads=2,
+    )
+    with start_server(config):
+        wait_until_connectable(metrics_url)
+        # 4 tasks for 2 threads, half of them wait
+        responses = await asyncio.gather(
+            *[fetch_text(f'{DEFAULT_HTTP_URL}executor?delay=0.5') for _ in range(4)]
+        )
+        assert len(set(responses)) == 2
+        assert all(name.startswith('aiohttp-serve-executor') for name in responses)
+        # wait for the worker to publish its metrics
+        await asyncio.sleep(1.5)
+
+        metrics = await fetch_text(metrics_url)
+        assert 'aiohttp_serve_executor_tasks_total{worker="0"} 4.0' in metrics
+        assert 'aiohttp_serve_executor_queue_depth{worker="0"} 0.0' in metrics
+        assert 'aiohttp_serve_executor_wait_seconds_bucket{worker="0",le="0.1"} 2.0' in metrics
+
+
+@pytest.mark.asyncio
+async def test_executor_shutdown_timeout():
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        executor_threads=1,
+        executor_shutdown_timeout=1,
+        shutdown_timeout=1,
+    )
+    with start_server(config) as process:
+        task = asyncio.ensure_future(fetch_text(f'{DEFAULT_HTTP_URL}executor?delay=20'))
+        await asyncio.sleep(0.5)
+        started = time.monotonic()
+        process.terminate()
+        # the busy executor thread is abandoned instead of joined on exit
+        await asyncio.get_event_loop().run_in_executor(None, process.join, 15)
+        assert not process.is_alive()
+        assert time.monotonic() - started < 10
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_async_access_log(tmp_path):
+    access_log_path = tmp_path / 'access.log'
+    log_config = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'handlers': {
+            'access': {
+                'class': 'logging.FileHandler',
+                'filename': str(access_log_path),
+            },
+        },
+        'loggers': {
+            'aiohttp.access': {
+                'handlers': ['access'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+        },
+    }
+    config = Config(
+        DEFAULT_APP,
+        host=DEFAULT_HOST,
+        port=DEFAULT_PORT,
+        workers=2,
+        log_config=log_config,
+        async_access_log=True,
+    )
+    with start_server(config):
+        for _ in range(5):
+            res = await fetch(url=DEFAULT_HTTP_URL)
+            assert res.status == 200
+
+    # records left in the queue are written out on shutdown
+    lines = access_log_path.read_text().splitlines()
+    assert len(lines) == 5
+    assert all('"GET / HTTP/1.1" 200' in line for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_ready_notification(tmp_path):
+    notify_path = str(tmp_path / 'notify.sock')
+    notify_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    notify_sock.bind(notify_path)
+    notify_sock.settimeout(20)
+    ready_r, ready_w = os.pipe()
+    callback_r, callback_w = os.pipe()
+    # on_ready isn't pickled for spawned workers, so a lambda will do
+    code = (
+        'import os, sys; '
+        'from aiohttp_serve import serve; '
+        'callback_fd = int(sys.argv[2]); '
+        'serve("tests.app:app", workers=2, start_method="spawn", ready_fd=int(sys.argv[1]), '
+        'on_ready=lambda: os.write(callback_fd, b"ready"))'
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-c', code, str(ready_w), str(callback_w)],
+        env=dict(os.environ, NOTIFY_SOCKET=notify_path),
+        pass_fds=(ready_w, callback_w),
+    )
+    os.close(ready_w)
+    os.close(callback_w)
+    try:
+        # all of them are notified once all workers listen
+        assert os.read(ready_r, 1) == b'\n'
+        assert os.read(ready_r, 1) == b''
+        assert os.read(callback_r, 5) == b'ready'
+        assert notify_sock.recv(1024) == f'READY=1\nMAINPID={process.pid}'.encode()
+        assert is_connectable(DEFAULT_HTTP_URL)
+        assert len(await wait_for_workers(f'{DEFAULT_HTTP_URL}pid', 2)) == 2
+
+        process.terminate()
+        assert notify_sock.recv(1024) == b'STOPPING=1'
+    finally:
+        process.terminate()
+        process.wait()
+        os.close(ready_r)
+        os.close(callback_r)
+        notify_sock.close()
@@ -1,10 +1,15 @@
+import asyncio
+import glob
 import logging
 import multiprocessing
+import os
 import socket
 import ssl
+import subprocess
+import sys
 import time
 from contextlib import contextmanager
-from typing import NamedTuple, Union, Awaitable, Optional, List, Type
+from typing import NamedTuple, Union, Awaitable, Optional, List, Type, Set, Dict
 
 from yarl import URL
 import aiohttp
@@ -56,13 +61,46 @@ class Config(NamedTuple):
     port: Optional[int] = 8080
     bind: Union[str, List[str]] = None
     workers: int = 1
+    min_workers: Optional[int] = None
+    max_workers: Optional[int] = None
+    autoscale_metric: Optional[str] = None
+    autoscale_up_threshold: Optional[float] = None
+    autoscale_down_threshold: Optional[float] = None
+    autoscale_interval: Optional[float] = None
+    autoscale_cooldown: Optional[float] = None
+    start_method: Optional[str] = None
+    preload_app: Optional[bool] = None
+    reuse_port: Optional[bool] = None
+    max_connections_per_worker: Optional[int] = None
+    overload_policy: Optional[str] = None
+    adaptive_keepalive: Optional[bool] = None
+    keepalive_min_timeout: Optional[float] = None
+    keepalive_pressure_threshold: Optional[float] = None
+    max_requests: Optional[int] = None
+    worker_timeout: Optional[float] = None
+    executor_threads: Optional[int] = None
+    executor_shutdown_timeout: Optional[float] = None
+    memory_profiling: Optional[bool] = None
+    memory_profiling_interval: Optional[float] = None
+    memory_profiling_dir: Optional[str] = None
+    shutdown_timeout: Optional[float] = None
+    cpu_affinity: Optional[Union[str, list]] = None
+    static: Optional[dict] = None
+    response_cache_size: Optional[int] = None
+    static_cache_ttl: Optional[float] = None
+    metrics_bind: Optional[str] = None
+    control_socket: Optional[str] = None
+    loop_monitor: Optional[bool] = None
+    slow_callback_threshold: Optional[float] = None
     ssl_certfile: Optional[str] = None
     ssl_keyfile: Optional[str] = None
     ssl_ca_certs: Optional[str] = None
+    ssl_watch_interval: Optional[float] = None
     log_config: Optional[Union[dict, str]] = None
     access_log_class: Type[web.AbstractAccessLogger] = web.AccessLogger
     access_log_format: str = web.AccessLogger.LOG_FORMAT
     access_log: Optional[logging.Logger] = web.access_logger
+    async_access_log: Optional[bool] = None
 
     def to_dict(self):
         d = {}
@@ -93,12 +131,64 @@ def start_server(config: Config):
     for url in config.get_bind_urls():
         wait_until_connectable(url)
     try:
-        yield None
+        yield process
     finally:
         process.terminate()
         process.join()
 
 
+@contextmanager
+def start_server_with_socket(sock: socket.socket, bind: str, env: Dict[str, str] = None):
+    """
+    Runs serve() in a new process that inherits `sock` as fd 3,
+    LISTEN_PID is set by the process itself like systemd does
+    """
+    code = (
+        'import os, sys; '
+        'os.environ.update(LISTEN_PID=str(os.getpid())) if "LISTEN_FDS" in os.environ else None; '
+        'from aiohttp_serve import serve; '
+        'serve("tests.app:app", bind=sys.argv[1], workers=2)'
+    )
+    fd = sock.fileno()
+    process = subprocess.Popen(
+        [sys.executable, '-c', code, bind],
+        env=dict(os.environ, **(env or {})),
+        pass_fds=(3,),
+        preexec_fn=lambda: os.dup2(fd, 3),
+    )
+    try:
+        yield process
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def get_children(pid: int) -> Set[int]:
+    children = set()
+    for path in glob.glob('/proc/[0-9]*/stat'):
+        try:
+            with open(path) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the process name in parentheses may contain spaces
+        state, ppid = stat.rsplit(')', 1)[1].split()[:2]
+        if int(ppid) == pid and state != 'Z':
+            children.add(int(path.split('/')[2]))
+    return children
+
+
+async def wait_for_children(pid: int, count: int, timeout: float = 20) -> Set[int]:
+    deadline = time.monotonic() + timeout
+    while True:
+        children = get_children(pid)
+        if len(children) == count:
+            return children
+        if time.monotonic() > deadline:
+            raise Exception(f'Process {pid} has {len(children)} children instead of {count}')
+        await asyncio.sleep(0.1)
+
+
 async def fetch(url: str, ssl_context: ssl.SSLContext = None, uds: str = None):
     connector = None
     if uds is not None:
@@ -107,3 +197,72 @@ async def fetch(url: str, ssl_context: ssl.SSLContext = None, uds: str = None):
     async with aiohttp.ClientSession(connector=connector) as session:
         async with session.get(url, ssl=ssl_context) as res:
             return res
+
+
+async def fetch_text(url: str) -> str:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as res:
+            return await res.text()
+
+
+async def fetch_pids(
+    url: str, count: int, ssl_context: ssl.SSLContext = None
+) -> List[int]:
+    """
+    Makes `count` requests to the pid endpoint, each one on a new connection
+    """
+    pids = []
+    connector = aiohttp.TCPConnector(force_close=True)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        for _ in range(count):
+            async with session.get(url, ssl=ssl_context) as res:
+                pids.append(int(await res.text()))
+    return pids
+
+
+async def wait_for_workers(
+    url: str, workers: int, ssl_context: ssl.SSLContext = None, timeout=10
+) -> Set[int]:
+    deadline = time.monotonic() + timeout
+    seen: Set[int] = set()
+    while len(seen) < workers:
+        if time.monotonic() > deadline:
+            raise Exception(f"Only {len(seen)} of {workers} workers are serving {url}")
+        seen.update(await fetch_pids(url, workers, ssl_context))
+    return seen
+
+
+class TLSResult(NamedTuple):
+    body: bytes
+    session: ssl.SSLSession
+    session_reused: bool
+    alpn_protocol: Optional[str]
+
+
+def tls_get(
+    host: str,
+    port: int,
+    path: str,
+    ssl_context: ssl.SSLContext,
+    session: Optional[ssl.SSLSession] = None,
+) -> TLSResult:
+    """
+    Makes a request on a new TLS connection, resuming `session` if given
+    """
+    with socket.create_connection((host, port), timeout=5) as raw_sock:
+        with ssl_context.wrap_socket(raw_sock, server_hostname=host, session=session) as sock:
+            request = f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'
+            sock.sendall(request.encode())
+            data = b''
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+            # TLS 1.3 session tickets arrive after the handshake
+            return TLSResult(
+                body=data.partition(b'\r\n\r\n')[2],
+                session=sock.session,
+                session_reused=sock.session_reused,
+                alpn_protocol=sock.selected_alpn_protocol(),
+            )